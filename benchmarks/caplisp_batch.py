@@ -0,0 +1,57 @@
+"""
+Compare evaluating a Caplisp expression row by row (walked and compiled) with evaluating it over whole columns.
+
+Run with ``python -m benchmarks.caplisp_batch``.
+"""
+import random
+import time
+
+from cps import columnar
+from cps.caplisp import Caplisp
+
+EXPRESSIONS = [
+    'x * y',
+    '(a + b) * (c - d) // (e + 1) + a % 7 - b * 2',
+    'f(x) * y + 3',
+]
+
+
+def main():
+    rows = 200_000
+    rng = random.Random(0)
+    columns = {name: [rng.randrange(1, 1000) for _ in range(rows)] for name in 'xyabcde'}
+    columns['f'] = abs
+    environments = [{name: value if callable(value) else value[i] for name, value in columns.items()}
+                    for i in range(rows)]
+    for source in EXPRESSIONS:
+        expr = Caplisp.parse_python(source)
+        compiled = expr.compile()
+
+        start = time.perf_counter()
+        expected = [expr.eval(environment) for environment in environments]
+        walked = time.perf_counter() - start
+        start = time.perf_counter()
+        [compiled(environment) for environment in environments]
+        called = time.perf_counter() - start
+        start = time.perf_counter()
+        assert list(Caplisp.eval_batch(expr, columns, use_numpy=False)) == expected
+        python = time.perf_counter() - start
+        line = (f"{source:<48} eval {walked * 1e3:7.1f} ms  compiled {called * 1e3:7.1f} ms  "
+                f"batch {python * 1e3:7.1f} ms")
+        if columnar.numpy is not None:
+            start = time.perf_counter()
+            result = Caplisp.eval_batch(expr, columns, use_numpy=True)
+            vectorized = time.perf_counter() - start
+            assert result.tolist() == expected
+            arrays = {name: value if callable(value) else columnar.numpy.array(value)
+                      for name, value in columns.items()}
+            start = time.perf_counter()
+            Caplisp.eval_batch(expr, arrays, use_numpy=True)
+            prebuilt = time.perf_counter() - start
+            line += (f"  numpy {vectorized * 1e3:7.1f} ms ({prebuilt * 1e3:6.1f} ms from arrays)"
+                     f"  speedup {walked / prebuilt:6.1f}x")
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+Compare the latency of an expression that calls slow services when evaluated serially and concurrently.
+
+Run with ``python -m benchmarks.caplisp_concurrent``.
+"""
+import asyncio
+import time
+
+from cps.caplisp import Caplisp
+
+EXPRESSIONS = [
+    'f(x) * g(y)',
+    'f(x) + g(y) + f(y) + g(x)',
+    '[f(x), g(y), f(g(x)), g(f(y))]',
+]
+
+
+def service(delay):
+    def call(x):
+        time.sleep(delay)
+        return x + 1
+    return call
+
+
+async def async_service(x):
+    await asyncio.sleep(0.02)
+    return x * 2
+
+
+def main():
+    environment = {'f': service(0.02), 'g': async_service, 'x': 1, 'y': 2}
+    serial_environment = dict(environment, g=service(0.02))
+    for source in EXPRESSIONS:
+        expr = Caplisp.parse_python(source)
+        start = time.perf_counter()
+        expr.eval(serial_environment)
+        serial = time.perf_counter() - start
+        start = time.perf_counter()
+        Caplisp.eval_concurrent(expr, environment)
+        concurrent = time.perf_counter() - start
+        print(f"{source:<36} serial {serial * 1e3:6.1f} ms  concurrent {concurrent * 1e3:6.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+Measure the memory held by a resident library of Caplisp programs, with and without interning.
+
+Run with ``python -m benchmarks.caplisp_memory``.
+"""
+import gc
+import tracemalloc
+
+from cps.caplisp import Caplisp, CaplispInterner
+
+TEMPLATES = [
+    'f(x) * g(y) + {n}',
+    '(a + b) * (c - d) // (e + {n}) + f(a) - g(b) * 2',
+    '[x, y, h(z, {n}, "label")]',
+    'score(account, weight(x) * 3 + {n}) - penalty(y)',
+]
+
+PROGRAMS = 10_000
+
+
+def sources() -> list[str]:
+    # a library where most programs share most of their structure with some others
+    return [TEMPLATES[i % len(TEMPLATES)].format(n=i % 2000) for i in range(PROGRAMS)]
+
+
+def measure(load) -> float:
+    texts = sources()
+    gc.collect()
+    tracemalloc.start()
+    library = load(texts)
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(library) == PROGRAMS
+    return current / PROGRAMS
+
+
+def main():
+    print(f"plain     {measure(lambda texts: [Caplisp.parse_python(t) for t in texts]):7.0f} bytes per program")
+
+    def interned(texts):
+        interner = CaplispInterner()
+        return [Caplisp.parse_python(t, interner) for t in texts]
+    print(f"interned  {measure(interned):7.0f} bytes per program")
+
+
+if __name__ == "__main__":
+    main()
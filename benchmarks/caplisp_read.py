@@ -0,0 +1,48 @@
+"""
+Compare loading a Caplisp corpus from its S-expressions against going back through Python source.
+
+Run with ``python -m benchmarks.caplisp_read``.
+"""
+import os
+import tempfile
+import time
+
+from cps.caplisp import Caplisp
+
+TEMPLATES = [
+    'f(x) * g(y) + {i}',
+    '(a + b) * (c - {i}) // (e + 1) + f(a) - g(b) * 2',
+    '[x, y, h(z, {i}, "label {i}")]',
+]
+
+
+def main():
+    count = 20_000
+    python_sources = [TEMPLATES[i % len(TEMPLATES)].format(i=i) for i in range(count)]
+    corpus = '\n'.join(Caplisp.parse_python(source).unparse() for source in python_sources)
+
+    start = time.perf_counter()
+    for source in python_sources:
+        Caplisp.parse_python(source)
+    from_python = time.perf_counter() - start
+
+    start = time.perf_counter()
+    loaded = sum(1 for _ in Caplisp.read_caplisp(corpus))
+    from_text = time.perf_counter() - start
+
+    with tempfile.NamedTemporaryFile('w', suffix='.caplisp', delete=False) as f:
+        f.write(corpus)
+    try:
+        start = time.perf_counter()
+        mapped = sum(1 for _ in Caplisp.load_caplisp(f.name))
+        from_file = time.perf_counter() - start
+    finally:
+        os.unlink(f.name)
+
+    assert loaded == mapped == count
+    print(f"{count} programs: parse_python {from_python * 1e3:7.1f} ms  "
+          f"read_caplisp {from_text * 1e3:7.1f} ms  load_caplisp (mmap) {from_file * 1e3:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
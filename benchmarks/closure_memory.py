@@ -0,0 +1,49 @@
+"""
+Measure the memory held by parked continuations, with and without closure pruning.
+
+Run with ``python -m benchmarks.closure_memory``. Each execution binds a large value that nothing after the suspension
+point reads. Without pruning, the continuation keeps it alive.
+"""
+import gc
+import tracemalloc
+
+from cps.simpy import Lambda, SimPy
+
+EXECUTIONS = 1_000
+
+
+def suspend(cont):
+    return cont
+
+
+def use(x, cont):
+    return cont(x)
+
+
+def park(prune: bool) -> list:
+    program = SimPy.parse("suspend()\nuse(x)")
+    parked = []
+    for i in range(EXECUTIONS):
+        env = {"suspend": suspend, "use": use, "x": i, "scratch": bytearray(10_000), "log": [str(j) for j in range(50)]}
+        cont = SimPy.eval(program, env)
+        if not prune:
+            # what the closure held before pruning: the whole environment it was created in
+            cont = Lambda(cont.args, cont.body, env)
+        parked.append(cont)
+    return parked
+
+
+def main():
+    for prune in (False, True):
+        gc.collect()
+        tracemalloc.start()
+        parked = park(prune)
+        gc.collect()
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        label = "pruned" if prune else "whole environment"
+        print(f"{label:<18} {current / len(parked):>9.0f} bytes per parked continuation")
+
+
+if __name__ == "__main__":
+    main()
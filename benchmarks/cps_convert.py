@@ -0,0 +1,20 @@
+"""
+Time SimPy.parse (parsing plus CPS conversion) on long scripts.
+
+Run with ``python -m benchmarks.cps_convert``. Time per statement should stay flat as scripts grow.
+"""
+import timeit
+
+from cps.simpy import SimPy
+
+
+def main():
+    for statements in (1_000, 10_000, 50_000, 100_000):
+        source = "\n".join(f"step{i % 10}(x, {i})" for i in range(statements))
+        runs = max(1, 100_000 // statements)
+        elapsed = timeit.timeit(lambda: SimPy.parse(source), number=runs) / runs
+        print(f"{statements:>7} statements: {elapsed * 1e3:8.2f} ms, {elapsed / statements * 1e6:5.2f} us/statement")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Measure what storing continuations by hash saves, on a corpus shaped like production: 100k executions spread over a
+few dozen capabilities, each suspended at one of its steps with a small environment of its own.
+
+Run with ``python -m benchmarks.dedup``.
+"""
+import ast
+import os
+import random
+import sys
+import tempfile
+import time
+
+from cps.cps import CapabilityExecutionState
+from cps.simpy import SimPy
+from cps.store import SQLiteStore
+
+CAPABILITIES = 36
+EXECUTIONS = 100_000
+
+
+def capability(rng: random.Random) -> list[str]:
+    """
+    :return: the continuation at each suspension point of a capability with a random number of steps
+    """
+    steps = [f"step{rng.randrange(12)}(order, 'label {rng.randrange(5)}', {rng.randrange(100)})"
+             for _ in range(rng.randrange(5, 40))]
+    return [f"lambda msg: {ast.unparse(SimPy.parse(chr(10).join(steps[point:])))}" for point in range(len(steps))]
+
+
+def main():
+    rng = random.Random(0)
+    capabilities = [capability(rng) for _ in range(CAPABILITIES)]
+    states = []
+    for i in range(EXECUTIONS):
+        continuations = rng.choice(capabilities)
+        states.append((str(i), CapabilityExecutionState({"order": i, "customer": f"customer {i % 977}"},
+                                                        rng.choice(continuations), f"orders.{i % 100}.paid")))
+    distinct = {state.continuation for _, state in states}
+    print(f"{EXECUTIONS} executions, {CAPABILITIES} capabilities, {len(distinct)} distinct continuations "
+          f"({sum(map(len, distinct)) / len(distinct):.0f} characters on average)")
+
+    sizes = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for dedup in (False, True):
+            path = os.path.join(directory, f"{dedup}.db")
+            with SQLiteStore(path, dedup=dedup) as store:
+                start = time.perf_counter()
+                store.save_many(states)
+                store.flush()
+                saving = time.perf_counter() - start
+                store.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                start = time.perf_counter()
+                loaded = store.waiting_on("orders.42.paid")
+                loading = time.perf_counter() - start
+            # the memory held by continuation sources across the loaded states, counting shared strings once
+            resident = sum(sys.getsizeof(s) for s in {id(s.continuation): s.continuation
+                                                       for s in loaded.values()}.values())
+            sizes[dedup] = store.bytes_written
+            name = "by hash" if dedup else "inline"
+            print(f"{name:<8} written {store.bytes_written / 1e6:7.1f} MB  file {os.path.getsize(path) / 1e6:7.1f} MB  "
+                  f"save {EXECUTIONS / saving:7.0f}/s  load {len(loaded)} in {loading * 1e3:5.1f} ms, "
+                  f"{resident / 1e3:7.1f} kB of continuation source in memory")
+    print(f"saved {(sizes[False] - sizes[True]) / 1e6:.1f} MB ({1 - sizes[True] / sizes[False]:.0%})")
+
+
+if __name__ == "__main__":
+    main()
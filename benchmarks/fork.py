@@ -0,0 +1,50 @@
+"""
+Compare forking a continuation with copy-on-write environments against deep-copying it.
+
+Run with ``python -m benchmarks.fork``.
+"""
+import copy
+import time
+import tracemalloc
+
+from cps.simpy import Lambda, Scope, SimPy
+
+BRANCHES = 10_000
+
+
+def measure(make_branch, cont) -> tuple[float, float]:
+    tracemalloc.start()
+    start = time.perf_counter()
+    branches = [make_branch(cont) for _ in range(BRANCHES)]
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del branches
+    return elapsed / BRANCHES, current / BRANCHES
+
+
+def main():
+    for size in (10, 100):
+        env = {"suspend": lambda cont: cont, "use": lambda *args: None}
+        env.update({f"v{i}": list(range(10)) for i in range(size)})
+        # a continuation that reads everything in the environment
+        program = SimPy.parse("suspend()\nuse(" + ", ".join(f"v{i}" for i in range(size)) + ")")
+        cont = SimPy.eval(program, env)
+
+        def fork_and_write(c):
+            branch = c.fork()
+            branch.environment["v0"] = None
+            return branch
+
+        def deep_copy(c):
+            # the safe fork we had before: copy everything the continuation holds
+            return Lambda(c.args, c.body, Scope(copy.deepcopy(c.environment.bindings), c.environment.parent))
+
+        forked = measure(fork_and_write, cont)
+        copied = measure(deep_copy, cont)
+        print(f"{size:>5} bindings: fork {forked[0] * 1e6:7.2f} us {forked[1]:7.0f} B/branch  "
+              f"deepcopy {copied[0] * 1e6:9.2f} us {copied[1]:9.0f} B/branch")
+
+
+if __name__ == "__main__":
+    main()
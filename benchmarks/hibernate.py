@@ -0,0 +1,69 @@
+"""
+Compare the memory held by suspended SimPy continuations kept resident with a HibernationManager that keeps only
+the most recent ones, and time waking hibernated executions.
+
+Run with ``python -m benchmarks.hibernate``.
+"""
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from cps.hibernate import HibernationManager
+from cps.simpy import SimPy
+from cps.store import SQLiteStore
+
+EXECUTIONS = 50_000
+RESIDENT = 5_000
+
+FUNCTIONS = {"wait": lambda cont: cont, "record": lambda order, items, cont: cont(len(items))}
+PROGRAM = SimPy.parse("wait()\nrecord(order, items)")
+
+
+def continuation(i: int):
+    return SimPy.run(PROGRAM, dict(FUNCTIONS, order=i, items=[f"item {i} {j}" for j in range(20)]))
+
+
+def managed(directory: str, name: str) -> tuple[HibernationManager, SQLiteStore]:
+    store = SQLiteStore(os.path.join(directory, name))
+    return HibernationManager(store, max_resident=RESIDENT, functions=FUNCTIONS), store
+
+
+def main():
+    tracemalloc.start()
+    resident = {str(i): continuation(i) for i in range(EXECUTIONS)}
+    all_resident = tracemalloc.get_traced_memory()[0]
+    del resident
+
+    with tempfile.TemporaryDirectory() as directory:
+        baseline = tracemalloc.get_traced_memory()[0]
+        manager, store = managed(directory, "traced.db")
+        for i in range(EXECUTIONS):
+            manager.park(str(i), continuation(i))
+        store.flush()
+        held = tracemalloc.get_traced_memory()[0] - baseline
+        tracemalloc.stop()
+        store.close()
+
+        manager, store = managed(directory, "timed.db")
+        start = time.perf_counter()
+        for i in range(EXECUTIONS):
+            manager.park(str(i), continuation(i))
+        store.flush()
+        parking = time.perf_counter() - start
+        rng = random.Random(0)
+        for i in rng.sample(range(EXECUTIONS - RESIDENT), 2_000):
+            manager.wake(str(i))()
+        metrics = manager.metrics()
+        store.close()
+
+    print(f"{EXECUTIONS} continuations resident: {all_resident / 1e6:6.1f} MB")
+    print(f"managed, {RESIDENT} resident:        {held / 1e6:6.1f} MB  "
+          f"(park {EXECUTIONS / parking:.0f}/s, {metrics['evictions']} evictions)")
+    print(f"rehydration: p50 {metrics['rehydration_p50'] * 1e6:.0f} us  p99 {metrics['rehydration_p99'] * 1e6:.0f} us  "
+          f"max {metrics['rehydration_max'] * 1e6:.0f} us over {metrics['rehydrations']} wakes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Time lambda calls in LInterpreter as the symbol table grows, against copying the symbol table on every call.
+
+Run with ``python -m benchmarks.linterpreter``.
+"""
+import ast
+import timeit
+
+from cps.cps import LInterpreter
+
+
+class CopyingInterpreter(LInterpreter):
+    # what on_call used to do: save the whole symbol table and put it back afterwards
+    def on_call(self, node: ast.Call):
+        func = self.run(node.func)
+        if not isinstance(func, ast.Lambda):
+            return super().on_call(node)
+        args = [self.run(arg) for arg in node.args]
+        old_table = self.symtable.copy()
+        for name, value in zip(func.args.args, args):
+            self.symtable[name.arg] = value
+        retval = self.run(func.body)
+        self.symtable = old_table
+        return retval
+
+
+def program(steps: int) -> ast.Module:
+    # a chain of continuation calls, nested the way CPS output is
+    source = "k(0)"
+    for i in range(steps):
+        source = f"(lambda x{i}: {source})({i})"
+    return ast.parse(source)
+
+
+def main():
+    steps = 50
+    tree = program(steps)
+    for size in (100, 1_000, 10_000, 100_000):
+        results = []
+        for cls in (CopyingInterpreter, LInterpreter):
+            symtable = {f"name{i}": i for i in range(size)}
+            symtable["k"] = lambda v: v
+            interpreter = cls(symtable=symtable, minimal=True)
+            runs = max(3, 20_000 // size)
+            results.append(timeit.timeit(lambda: interpreter.run(tree), number=runs) / runs / steps)
+        copying, frames = results
+        print(f"{size:>7} symbols: copying {copying * 1e6:9.2f} us/call  frames {frames * 1e6:6.2f} us/call  "
+              f"speedup {copying / frames:6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
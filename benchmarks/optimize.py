@@ -0,0 +1,35 @@
+"""
+Report how much the CPS optimizer shrinks programs, and what it costs to run.
+
+Run with ``python -m benchmarks.optimize``.
+"""
+import ast
+import time
+
+from cps.cps import CpsTransform
+from cps.optimize import metrics, optimize
+from cps.simpy import SimPy
+
+PROGRAMS = {
+    "simpy chain": lambda n: SimPy.parse("\n".join(f"step{i % 5}(x, {i} * 2)" for i in range(n))),
+    "simpy redexes": lambda n: ast.parse(" + ".join(f"(lambda x: plus(x, {i} * 3))(y)" for i in range(n))),
+    "cps.cps": lambda n: CpsTransform().visit(ast.parse("def f():\n    a()\n    b()\n" * n)),
+}
+
+
+def main():
+    for name, program in PROGRAMS.items():
+        for n in (10, 100):
+            tree = program(n)
+            before = metrics(tree)
+            start = time.perf_counter()
+            tree = optimize(tree)
+            elapsed = time.perf_counter() - start
+            after = metrics(tree)
+            print(f"{name:<14} n={n:<4} nodes {before['nodes']:>6} -> {after['nodes']:>6}  "
+                  f"size {before['size']:>6} -> {after['size']:>6} "
+                  f"({after['size'] / before['size']:4.0%})  in {elapsed * 1e3:7.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""
+Compare the binary execution state format with a source-text-in-JSON baseline, for size and throughput.
+
+Run with ``python -m benchmarks.persist``. Neither load parses the continuation; resume does that through the
+continuation cache.
+"""
+import ast
+import json
+import timeit
+
+from cps.cps import CapabilityExecutionState
+from cps.simpy import SimPy
+
+
+def continuation(steps: int) -> str:
+    return ast.unparse(SimPy.parse("\n".join(f"step{i % 7}(x, 'label {i % 3}', {i})" for i in range(steps))))
+
+
+def environment(size: int) -> dict:
+    return {f"var{i}": i * 3 if i % 2 else f"value {i}" for i in range(size)}
+
+
+def main():
+    runs = 1_000
+    for steps, size in ((5, 5), (20, 20), (80, 50)):
+        source = f"lambda msg: {continuation(steps)}"
+        state = CapabilityExecutionState(environment(size), source, "orders.*.paid")
+
+        baseline = json.dumps({"environment": state.environment, "continuation": source,
+                               "message_pattern": state.message_pattern}).encode()
+        binary = state.persist()
+
+        save_json = timeit.timeit(lambda: json.dumps({"environment": state.environment, "continuation": source,
+                                                      "message_pattern": state.message_pattern}).encode(),
+                                  number=runs) / runs
+        save_binary = timeit.timeit(state.persist, number=runs) / runs
+        load_json = timeit.timeit(lambda: json.loads(baseline), number=runs) / runs
+        load_binary = timeit.timeit(lambda: CapabilityExecutionState.load(binary), number=runs) / runs
+        print(f"{steps:>3} steps, {size:>3} vars: json {len(baseline):>6} B  binary {len(binary):>6} B  "
+              f"({len(binary) / len(baseline):4.0%})  "
+              f"save json {save_json * 1e6:7.1f} us  binary {save_binary * 1e6:7.1f} us  "
+              f"load json {load_json * 1e6:7.1f} us  binary {load_binary * 1e6:7.1f} us")
+
+
+if __name__ == "__main__":
+    main()
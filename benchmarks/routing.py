@@ -0,0 +1,27 @@
+"""
+Time message dispatch as the number of parked executions grows.
+
+Run with ``python -m benchmarks.routing``. Dispatch time should depend on the number of matches, not on the number
+of executions parked.
+"""
+import timeit
+
+from cps.cps import CapabilityExecutionState
+from cps.routing import MessageRouter
+
+
+def main():
+    runs = 10_000
+    for count in (1_000, 10_000, 100_000, 300_000):
+        router = MessageRouter()
+        for i in range(count):
+            # a mix of exact, single-segment and multi-segment wildcard patterns
+            pattern = (f"orders.{i}.paid", f"orders.*.shipped.{i}", f"customers.{i}.#")[i % 3]
+            router.add(i, CapabilityExecutionState({}, "lambda msg: msg", pattern))
+        exact = timeit.timeit(lambda: router.dispatch("orders.42.paid"), number=runs) / runs
+        wildcard = timeit.timeit(lambda: router.dispatch("customers.43.address.changed"), number=runs) / runs
+        print(f"{count:>7} parked: exact {exact * 1e6:6.2f} us  wildcard {wildcard * 1e6:6.2f} us")
+
+
+if __name__ == "__main__":
+    main()
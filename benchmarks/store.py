@@ -0,0 +1,56 @@
+"""
+Compare saving executions to SQLite with a commit per save against group commit, and time bulk loading by pattern.
+Then compare the bytes written by whole snapshots and by deltas, for executions that carry a large value that never
+changes through many steps.
+
+Run with ``python -m benchmarks.store``.
+"""
+import os
+import tempfile
+import time
+
+from cps.cps import CapabilityExecutionState
+from cps.store import SQLiteStore, TrackedEnvironment
+
+
+def state(i: int) -> CapabilityExecutionState:
+    return CapabilityExecutionState({"order": i, "customer": f"customer {i % 100}"},
+                                    "lambda msg: complete(msg, order)", f"orders.{i % 100}.paid")
+
+
+def main():
+    count = 20_000
+    states = [(str(i), state(i)) for i in range(count)]
+    with tempfile.TemporaryDirectory() as directory:
+        for name, batch_size in (("commit per save", 1), ("group commit", 1000)):
+            path = os.path.join(directory, f"{batch_size}.db")
+            with SQLiteStore(path, batch_size=batch_size) as store:
+                start = time.perf_counter()
+                store.save_many(states)
+                store.flush()
+                elapsed = time.perf_counter() - start
+                print(f"{name:<16} {count / elapsed:9.0f} saves/s")
+
+                start = time.perf_counter()
+                waiting = store.waiting_on("orders.42.paid")
+                elapsed = time.perf_counter() - start
+                print(f"{'':<16} loaded {len(waiting)} waiting on one pattern in {elapsed * 1e3:.2f} ms")
+
+        executions, steps = 500, 20
+        for name, make in (("snapshots", dict), ("deltas", TrackedEnvironment)):
+            path = os.path.join(directory, f"{name}.db")
+            environments = [make(catalog=list(range(2_000)), step=0) for _ in range(executions)]
+            with SQLiteStore(path) as store:
+                start = time.perf_counter()
+                for step in range(steps):
+                    for i, environment in enumerate(environments):
+                        environment["step"] = step
+                        store.save(str(i), CapabilityExecutionState(environment, "lambda msg: step", "next"))
+                store.flush()
+                elapsed = time.perf_counter() - start
+                print(f"{name:<16} {executions * steps / elapsed:9.0f} saves/s, "
+                      f"{store.bytes_written / 1e6:6.1f} MB written")
+
+
+if __name__ == "__main__":
+    main()
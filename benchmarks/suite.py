@@ -0,0 +1,195 @@
+"""
+A microbenchmark suite for the main paths: parsing, transforming, evaluating, suspending and resuming.
+
+Each benchmark runs over synthetic programs of growing size (statements in sequence) or depth (nesting). Results can
+be saved as JSON and compared against a saved baseline, so a slowdown shows up before it is deployed:
+
+  python -m benchmarks --output baseline.json
+  python -m benchmarks --baseline baseline.json --output current.json
+
+The comparison uses the fastest of several repeats, which is the least noisy measure on a shared machine, and exits
+with status 1 if any benchmark got slower than the tolerance allows. Baselines only mean something on the machine
+they were made on, and a busy or virtualized one can drift by more than the default tolerance from run to run.
+"""
+import argparse
+import ast
+import datetime
+import json
+import platform
+import statistics
+import sys
+import timeit
+from typing import Any, Callable, Iterator, NamedTuple, Optional
+
+from cps.caplisp import Caplisp
+from cps.cps import CapabilityDefinition, CpsTransform
+from cps.simpy import SimPy
+
+
+class Benchmark(NamedTuple):
+    name: str
+    parameter: str
+    values: tuple[int, ...]
+    # given the parameter's value, does any setup and returns the function to time
+    prepare: Callable[[int], Callable[[], Any]]
+
+
+def sequence(size: int) -> str:
+    return "\n".join(f"step(x, {i})" for i in range(size))
+
+
+def nested(depth: int) -> str:
+    return "step(" * depth + "x" + ", 1)" * depth
+
+
+def expression(depth: int) -> str:
+    # a balanced tree of binary operators, 2 ** depth leaves
+    if depth == 0:
+        return "x"
+    operator = "+-*"[depth % 3]
+    return f"({expression(depth - 1)} {operator} {expression(depth - 1)})"
+
+
+def step(*args):
+    # the last argument of a CPS call is its continuation
+    return args[-1](None)
+
+
+def suspend(cont):
+    return cont
+
+
+def simpy_eval(size: int) -> Callable[[], Any]:
+    tree = SimPy.parse(sequence(size))
+    return lambda: SimPy.run(tree, {"step": step, "x": 1})
+
+
+def simpy_resume(size: int) -> Callable[[], Any]:
+    # a suspended continuation can be resumed any number of times
+    return SimPy.run(SimPy.parse("suspend()\n" + sequence(size)), {"step": step, "suspend": suspend, "x": 1})
+
+
+def caplisp_eval(depth: int) -> Callable[[], Any]:
+    tree = Caplisp.parse_python(expression(depth))
+    environment = {"x": 3}
+    return lambda: tree.eval(environment)
+
+
+def caplisp_unparse(depth: int) -> Callable[[], Any]:
+    return Caplisp.parse_python(expression(depth)).unparse
+
+
+def handlers(size: int) -> str:
+    # the two-statement functions CpsTransform turns into CPS
+    return "\n".join(f"def handler{i}():\n    step(x, {i})\n    step(x, {i + 1})" for i in range(size))
+
+
+def cps_transform(size: int) -> Callable[[], Any]:
+    functions = ast.parse(handlers(size)).body
+
+    def module() -> ast.Module:
+        # the transformer replaces each statement's value, so give it fresh statements around the same calls every time
+        return ast.Module(body=[ast.FunctionDef(name=function.name, args=function.args, decorator_list=[],
+                                                body=[ast.Expr(value=statement.value) for statement in function.body],
+                                                lineno=function.lineno)
+                                for function in functions], type_ignores=[])
+
+    assert ast.unparse(CpsTransform().visit(module())).startswith("def handler0():\n    step_cps(x, 0, lambda: ")
+    return lambda: CpsTransform().visit(module())
+
+
+def total_cps(*values):
+    # a builtin in CPS style: it hands back the function the first message resumes
+    return lambda message: sum(values)
+
+
+def capability_execute(size: int) -> Callable[[], Any]:
+    definition = CapabilityDefinition(f"total({', '.join(f'{i} * 2' for i in range(size))})")
+    environment = {"total_cps": total_cps}
+    # asteval reports errors instead of raising them, so make sure this isn't timing one
+    assert definition.execute(environment) == size * (size - 1)
+    return lambda: definition.execute(environment)
+
+
+BENCHMARKS = [
+    Benchmark("simpy.parse", "size", (10, 100, 1000), lambda size: lambda: SimPy.parse(sequence(size))),
+    Benchmark("simpy.parse", "depth", (10, 50, 90), lambda depth: lambda: SimPy.parse(nested(depth))),
+    Benchmark("simpy.eval", "size", (10, 100, 1000), simpy_eval),
+    Benchmark("simpy.resume", "size", (10, 100, 1000), simpy_resume),
+    Benchmark("caplisp.parse_python", "depth", (2, 6, 10),
+              lambda depth: lambda: Caplisp.parse_python(expression(depth))),
+    Benchmark("caplisp.eval", "depth", (2, 6, 10), caplisp_eval),
+    Benchmark("caplisp.unparse", "depth", (2, 6, 10), caplisp_unparse),
+    Benchmark("cps.transform", "size", (10, 100, 1000), cps_transform),
+    Benchmark("cps.execute", "size", (10, 100, 1000), capability_execute),
+]
+
+
+def run(benchmarks: list[Benchmark], repeat: int = 5, quick: bool = False,
+        name_filter: Optional[str] = None) -> Iterator[tuple[str, dict[str, Any]]]:
+    """
+    :param quick: only the smallest size of each benchmark, and fewer repeats, to check that the suite still runs
+    :return: each result's key, and its timings in seconds per call
+    """
+    for benchmark in benchmarks:
+        for value in benchmark.values[:1] if quick else benchmark.values:
+            key = f"{benchmark.name}[{benchmark.parameter}={value}]"
+            if name_filter and name_filter not in key:
+                continue
+            timer = timeit.Timer(benchmark.prepare(value))
+            number, _ = timer.autorange()
+            times = [elapsed / number for elapsed in timer.repeat(repeat=2 if quick else repeat, number=number)]
+            yield key, {"min": min(times), "median": statistics.median(times), "number": number,
+                        "repeat": len(times)}
+
+
+def compare(baseline: dict[str, Any], current: dict[str, Any], tolerance: float) -> list[str]:
+    """
+    :return: the keys of the benchmarks that got slower than the baseline by more than tolerance (0.1 is 10%)
+    """
+    return [key for key, result in current["results"].items()
+            if key in baseline["results"] and result["min"] > baseline["results"][key]["min"] * (1 + tolerance)]
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", help="save the results to this JSON file")
+    parser.add_argument("--baseline", help="compare against results saved earlier with --output")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="how much slower than the baseline counts as a regression (default 0.25, i.e. 25%%)")
+    parser.add_argument("--filter", help="only run benchmarks whose key contains this")
+    parser.add_argument("--repeat", type=int, default=5, help="timing runs per benchmark; the fastest is kept")
+    parser.add_argument("--quick", action="store_true", help="only the smallest sizes, to check the suite runs")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = {}
+    for key, result in run(BENCHMARKS, args.repeat, args.quick, args.filter):
+        results[key] = result
+        line = f"{key:<36} {result['min'] * 1e6:12.2f} us  (median {result['median'] * 1e6:12.2f} us)"
+        if baseline and key in baseline["results"]:
+            line += f"  {result['min'] / baseline['results'][key]['min']:6.2f}x baseline"
+        print(line, flush=True)
+
+    current = {
+        "meta": {"python": sys.version.split()[0], "implementation": platform.python_implementation(),
+                 "machine": platform.machine(), "platform": platform.platform(),
+                 "time": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2)
+
+    if baseline:
+        regressions = compare(baseline, current, args.tolerance)
+        for key in regressions:
+            print(f"REGRESSION {key}: {results[key]['min'] * 1e6:.2f} us, "
+                  f"baseline {baseline['results'][key]['min'] * 1e6:.2f} us")
+        if regressions:
+            return 1
+    return 0
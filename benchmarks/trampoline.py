@@ -0,0 +1,33 @@
+"""
+Time trampolined evaluation of long continuation chains.
+
+Run with ``python -m benchmarks.trampoline``. The time per step should stay flat as the chain grows.
+"""
+import ast
+import timeit
+
+from cps.simpy import SimPy, CpsTransformer
+
+
+def chain(length: int) -> ast.Module:
+    body = ast.Call(func=ast.Name(id="complete", ctx=ast.Load()), args=[], keywords=[])
+    for _ in range(length):
+        cont = ast.Lambda(args=CpsTransformer().blank_arguments(), body=body)
+        body = ast.Call(func=ast.Name(id="step", ctx=ast.Load()), args=[cont], keywords=[])
+    return ast.Module(body=[ast.Expr(value=body)], type_ignores=[])
+
+
+def step(cont):
+    return cont(None)
+
+
+def main():
+    for length in (100, 1_000, 10_000, 100_000):
+        tree = chain(length)
+        runs = max(1, 100_000 // length)
+        elapsed = timeit.timeit(lambda: SimPy.run(tree, {"step": step}), number=runs) / runs
+        print(f"{length:>7} steps: {elapsed * 1e3:9.3f} ms total, {elapsed / length * 1e6:6.3f} us/step")
+
+
+if __name__ == "__main__":
+    main()
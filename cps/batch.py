@@ -0,0 +1,127 @@
+"""
+Resuming a burst of suspended executions across a pool of processes.
+
+Interpretation is CPU-bound and holds the GIL, so we spread a batch over several processes. Each execution goes to
+the worker chosen by the hash of its continuation. Executions that share a continuation therefore land on the same
+worker, where the continuation cache already has the parsed tree.
+"""
+import concurrent.futures
+import os
+import pickle
+from typing import Any, Iterable, NamedTuple, Optional
+
+from cps.cps import CapabilityExecutionState, continuation_hash
+
+
+class ResumeResult(NamedTuple):
+    value: Any = None
+    error: Optional[BaseException] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def _resume_chunk(chunk: list[tuple[bytes, Any]]) -> list[bytes]:
+    # runs in the worker; each result is pickled on its own so that one unpicklable value only fails its own entry
+    results = []
+    for state, message in chunk:
+        try:
+            result = pickle.dumps(ResumeResult(CapabilityExecutionState.load(state).resume(message, raise_errors=True)))
+        except Exception as e:
+            try:
+                result = pickle.dumps(ResumeResult(error=e))
+            except Exception:
+                result = pickle.dumps(ResumeResult(error=RuntimeError(repr(e))))
+        results.append(result)
+    return results
+
+
+class BatchResumer:
+    def __init__(self, workers: Optional[int] = None, chunk_size: int = 256):
+        """
+        :param workers: number of worker processes; defaults to one per CPU
+        :param chunk_size: how many executions to send to a worker at a time
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        # one single-process pool per shard, so that a shard always goes to the same process
+        self.shards = [concurrent.futures.ProcessPoolExecutor(max_workers=1) for _ in range(self.workers)]
+
+    def __enter__(self) -> "BatchResumer":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+
+    def shutdown(self):
+        for shard in self.shards:
+            shard.shutdown()
+
+    def shard(self, state: CapabilityExecutionState) -> int:
+        return int(continuation_hash(state.continuation)[:8], 16) % self.workers
+
+    def resume(self, batch: Iterable[tuple[CapabilityExecutionState, Any]]) -> list[ResumeResult]:
+        """
+        Resume each execution with its message.
+
+        :return: one result per execution, in the order given; a failure is reported in its own result
+        """
+        results: list[Optional[ResumeResult]] = []
+        pending: list[list[tuple[int, bytes, Any]]] = [[] for _ in range(self.workers)]
+        for index, (state, message) in enumerate(batch):
+            results.append(None)
+            try:
+                pending[self.shard(state)].append((index, state.persist(), message))
+            except Exception as e:
+                results[index] = ResumeResult(error=e)
+
+        submitted = []
+        for shard, items in enumerate(pending):
+            for start in range(0, len(items), self.chunk_size):
+                chunk = items[start:start + self.chunk_size]
+                future = self.shards[shard].submit(_resume_chunk, [(state, message) for _, state, message in chunk])
+                submitted.append((shard, chunk, future))
+
+        # entries lost with a worker that died, which may have been any one of them, or a chunk queued behind it
+        orphaned: list[list[tuple[int, bytes, Any]]] = [[] for _ in range(self.workers)]
+        for shard, chunk, future in submitted:
+            try:
+                for (index, _, _), result in zip(chunk, future.result()):
+                    results[index] = pickle.loads(result)
+            except concurrent.futures.process.BrokenProcessPool:
+                orphaned[shard].extend(chunk)
+            except Exception as e:
+                for index, _, _ in chunk:
+                    results[index] = ResumeResult(error=e)
+
+        for shard, items in enumerate(orphaned):
+            if items:
+                self.replace(shard)
+            # one at a time, so only the entry that kills its worker fails
+            for index, state, message in items:
+                try:
+                    future = self.shards[shard].submit(_resume_chunk, [(state, message)])
+                    results[index] = pickle.loads(future.result()[0])
+                except Exception as e:
+                    results[index] = ResumeResult(error=e)
+                    if isinstance(e, concurrent.futures.process.BrokenProcessPool):
+                        self.replace(shard)
+        return results
+
+    def replace(self, shard: int):
+        """
+        Give a shard whose worker died a new process.
+        """
+        self.shards[shard].shutdown(wait=False)
+        self.shards[shard] = concurrent.futures.ProcessPoolExecutor(max_workers=1)
+
+
+def resume_batch(batch: Iterable[tuple[CapabilityExecutionState, Any]],
+                 workers: Optional[int] = None) -> list[ResumeResult]:
+    """
+    Resume a batch with a throwaway pool. Callers resuming batches repeatedly should keep a BatchResumer instead,
+    so its workers' caches stay warm.
+    """
+    with BatchResumer(workers) as resumer:
+        return resumer.resume(batch)
@@ -6,21 +6,146 @@ We translate Python into an internal language with CPS. The internal language is
 
 """
 import abc
+import asyncio
 import collections.abc
+import functools
+import inspect
+import math
+import mmap
 import operator
+import re
 import typing
+from concurrent.futures import Executor, ThreadPoolExecutor
 from typing import Any
 import ast
 
+from cps import columnar
+from cps.cache import LRUCache
+
+OPMAP = {ast.Add: operator.add,
+         ast.Sub: operator.sub,
+         ast.Mult: operator.mul,
+         ast.MatMult: operator.matmul,
+         ast.Div: operator.truediv,
+         ast.Mod: operator.mod,
+         ast.Pow: operator.pow,
+         ast.LShift: operator.lshift,
+         ast.RShift: operator.rshift,
+         ast.BitOr: operator.or_,
+         ast.BitXor: operator.xor,
+         ast.BitAnd: operator.and_,
+         ast.FloorDiv: operator.floordiv}
+OPNAMES = {ast.Add: '+',
+           ast.Sub: '-',
+           ast.Mult: '*',
+           ast.MatMult: '@',
+           ast.Div: '/',
+           ast.Mod: '%',
+           ast.Pow: '**',
+           ast.LShift: '<<',
+           ast.RShift: '>>',
+           ast.BitOr: '|',
+           ast.BitXor: '^',
+           ast.BitAnd: '&',
+           ast.FloorDiv: '//'}
+OPERATORS = {OPNAMES[op]: func for op, func in OPMAP.items()}
+
+
 class Caplisp:
     @staticmethod
-    def parse_python(str) -> "CaplispNode":
+    def parse_python(str, interner: typing.Optional["CaplispInterner"] = None) -> "CaplispNode":
         my_ast = ast.parse(str)
-        return PythonToCaplisp().visit(my_ast)
+        tree = PythonToCaplisp().visit(my_ast)
+        return interner.intern(tree) if interner is not None else tree
+
+    @staticmethod
+    def parse_caplisp(str, legacy: bool = False) -> "CaplispNode":
+        nodes = list(CaplispReader(str, legacy=legacy))
+        if len(nodes) != 1:
+            raise ValueError(f"expected one Caplisp expression, found {len(nodes)}")
+        return nodes[0]
+
+    @staticmethod
+    def read_caplisp(source: typing.Union[str, bytes, memoryview, mmap.mmap],
+                     interner: typing.Optional["CaplispInterner"] = None,
+                     legacy: bool = False) -> typing.Iterator["CaplispNode"]:
+        """
+        Read the expressions in source one after another, straight from the buffer.
+
+        :param legacy: source was written by the old unparse, which put lists in parentheses (see CaplispReader)
+        """
+        return iter(CaplispReader(source, interner, legacy))
+
+    @staticmethod
+    def load_caplisp(path: str, interner: typing.Optional["CaplispInterner"] = None,
+                     legacy: bool = False) -> typing.Iterator["CaplispNode"]:
+        """
+        Read every expression in a file, through a memory map rather than by reading the file into memory.
+        """
+        with open(path, 'rb') as f:
+            if f.seek(0, 2) == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                yield from CaplispReader(buffer, interner, legacy)
 
     @staticmethod
-    def parse_caplisp(str) -> "CaplispNode":
-        raise NotImplementedError
+    def resolve(node: "CaplispNode", share: bool = True) -> "SlottedExpression":
+        return SlottedExpression(node, share)
+
+    @staticmethod
+    async def eval_async(node: "CaplispNode", environment: dict[str, Any], max_concurrent: int = 10,
+                         executor: typing.Optional[Executor] = None) -> Any:
+        """
+        Evaluate node, making the calls in independent arguments at the same time instead of one after another.
+
+        Coroutine functions are awaited, and other functions (except the operators) are run on executor, so a slow
+        call only holds up the calls that need its result.
+
+        :param max_concurrent: how many calls may be in flight at once
+        :param executor: where to run blocking calls; by default, a thread pool of max_concurrent threads
+        """
+        if executor is not None:
+            return await node.eval_async(environment, ConcurrentCalls(max_concurrent, executor))
+        with ThreadPoolExecutor(max_concurrent) as executor:
+            return await node.eval_async(environment, ConcurrentCalls(max_concurrent, executor))
+
+    @staticmethod
+    def eval_concurrent(node: "CaplispNode", environment: dict[str, Any], max_concurrent: int = 10) -> Any:
+        """
+        Run eval_async to completion, from code that isn't already in an event loop.
+        """
+        return asyncio.run(Caplisp.eval_async(node, environment, max_concurrent))
+
+    @staticmethod
+    def pure(func: typing.Optional[typing.Callable] = None, *, maxsize: int = 1024):
+        """
+        Mark a function as pure, so calls to it are remembered by argument values. Works as a decorator, with or
+        without arguments.
+        """
+        if func is None:
+            return lambda func: PureFunction(func, maxsize)
+        return PureFunction(func, maxsize)
+
+    @staticmethod
+    def eval_batch(node: "CaplispNode", columns: dict[str, Any], use_numpy: typing.Optional[bool] = None) -> list:
+        """
+        Evaluate node once per row of a columnar batch, giving the same answers as calling eval on each row.
+
+        Every sequence in columns is a column and must have the same length; any other value (a function, say) is the
+        same for every row. With NumPy (used if installed, unless use_numpy is False) the result is an array, and
+        integer arithmetic is done in NumPy's fixed-width integers.
+
+        :return: one result per row
+        """
+        lengths = {len(value) for value in columns.values()
+                   if isinstance(value, collections.abc.Sequence) and not isinstance(value, (str, bytes))
+                   or hasattr(value, '__array__')}
+        if len(lengths) > 1:
+            raise ValueError(f"columns have different lengths: {sorted(lengths)}")
+        batch = columnar.batch_for(lengths.pop() if lengths else 1, use_numpy)
+        # only convert the columns this expression actually reads
+        used = {name: batch.column(columns[name]) for name in set(node.variables())}
+        return batch.broadcast(node.eval_batch(used, batch))
 
 
 class CaplispInterpreter:
@@ -36,6 +161,8 @@ class CaplispInterpreter:
 
 
 class CaplispNode(abc.ABC):
+    __slots__ = ()
+
     @abc.abstractmethod
     def eval(self, environment: dict[str, Any]) -> Any:
         pass
@@ -44,8 +171,44 @@ class CaplispNode(abc.ABC):
     def unparse(self) -> str:
         pass
 
+    @abc.abstractmethod
+    def compile(self, slots: typing.Optional[dict[str, int]] = None) -> typing.Callable[[Any], Any]:
+        """
+        Turn this tree into nested closures once, so that evaluating it again is a single call.
+
+        :param slots: if given, variables are read from these positions in a sequence instead of by name
+        :return: a function of the environment (or slot sequence) that gives the same answer as eval
+        """
+        pass
+
+    @abc.abstractmethod
+    def eval_batch(self, columns: dict[str, Any], batch: "columnar.PythonBatch") -> Any:
+        """
+        Evaluate this tree for every row of a batch at once.
+
+        :param columns: the environment, with a column in place of each value that varies from row to row
+        :param batch: the backend that knows what a column is and how to apply a function to columns
+        :return: a column, or a scalar if the result is the same for every row
+        """
+        pass
+
+    @abc.abstractmethod
+    async def eval_async(self, environment: dict[str, Any], calls: "ConcurrentCalls") -> Any:
+        """
+        Evaluate this tree, leaving calls to be made through calls, and evaluating independent arguments at once.
+        """
+        pass
+
+    def variables(self) -> typing.Iterator[str]:
+        """
+        :return: the names of the variables this tree refers to, in order of appearance
+        """
+        return iter(())
+
 
 class CaplispConstant(CaplispNode):
+    __slots__ = ('value',)
+
     def __init__(self, value):
         self.value = value
 
@@ -53,10 +216,34 @@ class CaplispConstant(CaplispNode):
         return self.value
 
     def unparse(self):
-        return str(self.value)
+        # everything must read back as the same constant, not as a variable (so strings are quoted, and there is a sign
+        # in front of inf and nan), and be a single atom (so complex numbers lose their parentheses)
+        value = self.value
+        if isinstance(value, (str, bytes)):
+            return repr(value)
+        if value is ...:
+            return '...'
+        if isinstance(value, float) and not math.isfinite(value):
+            return f'{value:+}'
+        if isinstance(value, complex):
+            text = repr(value).strip('()')
+            return text if text.startswith(('+', '-')) else '+' + text
+        return str(value)
+
+    def compile(self, slots: typing.Optional[dict[str, int]] = None) -> typing.Callable[[Any], Any]:
+        value = self.value
+        return lambda environment: value
+
+    def eval_batch(self, columns: dict[str, Any], batch: "columnar.PythonBatch") -> Any:
+        return self.value
+
+    async def eval_async(self, environment: dict[str, Any], calls: "ConcurrentCalls") -> Any:
+        return self.value
 
 
 class CaplispVariable(CaplispNode):
+    __slots__ = ('id',)
+
     def __init__(self, id):
         self.id = id
 
@@ -66,20 +253,75 @@ class CaplispVariable(CaplispNode):
     def unparse(self):
         return self.id
 
+    def compile(self, slots: typing.Optional[dict[str, int]] = None) -> typing.Callable[[Any], Any]:
+        return operator.itemgetter(self.id if slots is None else slots[self.id])
+
+    def eval_batch(self, columns: dict[str, Any], batch: "columnar.PythonBatch") -> Any:
+        return columns[self.id]
+
+    async def eval_async(self, environment: dict[str, Any], calls: "ConcurrentCalls") -> Any:
+        return environment[self.id]
+
+    def variables(self) -> typing.Iterator[str]:
+        yield self.id
+
 
 class CaplispFuncall(CaplispNode):
+    __slots__ = ('func', 'args')
+
     def __init__(self, func: Any, *args: CaplispNode):
         self.func = func
         self.args = args
 
     def unparse(self) -> str:
-        return CaplispList([self.func] + list(self.args)).unparse()
+        return '(' + ' '.join(item.unparse() for item in [self.func, *self.args]) + ')'
 
     def eval(self, environment: dict[str, Any]) -> Any:
         return self.func.eval(environment)(*[a.eval(environment) for a in self.args])
 
+    def variables(self) -> typing.Iterator[str]:
+        yield from self.func.variables()
+        for a in self.args:
+            yield from a.variables()
+
+    def compile(self, slots: typing.Optional[dict[str, int]] = None) -> typing.Callable[[Any], Any]:
+        args = tuple(a.compile(slots) for a in self.args)
+
+        if isinstance(self.func, CaplispFunctionReference):
+            # the function is known now, so specialize on it and on the common arities
+            realfunc = self.func.realfunc
+            if len(args) == 0:
+                return lambda environment: realfunc()
+            elif len(args) == 1:
+                a, = args
+                return lambda environment: realfunc(a(environment))
+            elif len(args) == 2:
+                a, b = args
+                return lambda environment: realfunc(a(environment), b(environment))
+            return lambda environment: realfunc(*[a(environment) for a in args])
+
+        func = self.func.compile(slots)
+        if len(args) == 0:
+            return lambda environment: func(environment)()
+        elif len(args) == 1:
+            a, = args
+            return lambda environment: func(environment)(a(environment))
+        elif len(args) == 2:
+            a, b = args
+            return lambda environment: func(environment)(a(environment), b(environment))
+        return lambda environment: func(environment)(*[a(environment) for a in args])
+
+    def eval_batch(self, columns: dict[str, Any], batch: "columnar.PythonBatch") -> Any:
+        return batch.apply(self.func.eval_batch(columns, batch), [a.eval_batch(columns, batch) for a in self.args])
+
+    async def eval_async(self, environment: dict[str, Any], calls: "ConcurrentCalls") -> Any:
+        func = await self.func.eval_async(environment, calls)
+        return await calls.call(func, await calls.gather(self.args, environment))
+
 
 class CaplispFunctionReference(CaplispNode):
+    __slots__ = ('realfunc', 'name')
+
     def __init__(self, realfunc: typing.Callable, name: str):
         self.realfunc = realfunc
         self.name = name
@@ -90,8 +332,68 @@ class CaplispFunctionReference(CaplispNode):
     def eval(self, environment: dict[str, Any]) -> Any:
         return self.realfunc
 
+    def compile(self, slots: typing.Optional[dict[str, int]] = None) -> typing.Callable[[Any], Any]:
+        realfunc = self.realfunc
+        return lambda environment: realfunc
+
+    def eval_batch(self, columns: dict[str, Any], batch: "columnar.PythonBatch") -> Any:
+        return self.realfunc
+
+    async def eval_async(self, environment: dict[str, Any], calls: "ConcurrentCalls") -> Any:
+        return self.realfunc
+
+
+class PureFunction:
+    """
+    A function whose result depends only on its arguments, with the results of recent calls kept in an LRU cache.
+
+    Calls with unhashable arguments are passed straight through. As with lru_cache(typed=True), arguments of
+    different types are cached apart, even if they are equal (1, 1.0 and True).
+    """
+    def __init__(self, func: typing.Callable, maxsize: int = 1024):
+        functools.update_wrapper(self, func)
+        self.func = func
+        self.cache = LRUCache(maxsize)
+
+    def __call__(self, *args):
+        key = self.key(args)
+        try:
+            hash(key)
+        except TypeError:
+            return self.func(*args)
+        return self.cache.get(key, lambda: self.func(*args))
+
+    def __reduce__(self):
+        return PureFunction, (self.func, self.cache.maxsize)
+
+    @staticmethod
+    def key(args: typing.Sequence[Any]) -> tuple:
+        return tuple(args) + tuple(type(arg) for arg in args)
+
+    def cached(self, args: typing.Sequence[Any]) -> bool:
+        try:
+            return self.key(args) in self.cache
+        except TypeError:
+            return False
+
+
+def is_pure(func: Any) -> bool:
+    """
+    :return: whether calling func twice with the same arguments is sure to give the same answer
+    """
+    return isinstance(func, PureFunction) or func in PURE_OPERATORS
+
+
+# the operators are pure, but far too cheap to be worth caching; they are only shared within a tree
+PURE_OPERATORS = set(OPERATORS.values())
+
+# one reference per operator, shared by every program that uses it
+OPERATOR_REFERENCES = {name: CaplispFunctionReference(func, name) for name, func in OPERATORS.items()}
+
 
 class CaplispList(CaplispNode):
+    __slots__ = ('elements',)
+
     def __init__(self, elements: list[CaplispNode]):
         self.elements = elements
 
@@ -99,7 +401,302 @@ class CaplispList(CaplispNode):
         return [item.eval(environment) for item in self.elements]
 
     def unparse(self) -> str:
-        return '(' + ' '.join(item.unparse() for item in self.elements) + ')'
+        return '[' + ' '.join(item.unparse() for item in self.elements) + ']'
+
+    def variables(self) -> typing.Iterator[str]:
+        for item in self.elements:
+            yield from item.variables()
+
+    def compile(self, slots: typing.Optional[dict[str, int]] = None) -> typing.Callable[[Any], Any]:
+        elements = tuple(item.compile(slots) for item in self.elements)
+        return lambda environment: [item(environment) for item in elements]
+
+    def eval_batch(self, columns: dict[str, Any], batch: "columnar.PythonBatch") -> Any:
+        return batch.apply(_row_list, [item.eval_batch(columns, batch) for item in self.elements])
+
+    async def eval_async(self, environment: dict[str, Any], calls: "ConcurrentCalls") -> Any:
+        return await calls.gather(self.elements, environment)
+
+
+def _row_list(*items):
+    return list(items)
+
+
+class ConcurrentCalls:
+    """
+    How Caplisp.eval_async makes its calls: at most max_concurrent at once, blocking ones on executor.
+    """
+    def __init__(self, max_concurrent: int, executor: Executor):
+        if max_concurrent < 1:
+            raise ValueError(f"max_concurrent must be positive, not {max_concurrent}")
+        self.limit = asyncio.Semaphore(max_concurrent)
+        self.executor = executor
+
+    async def gather(self, nodes: typing.Sequence[CaplispNode], environment: dict[str, Any]) -> list:
+        # constants and variables are ready at once; only fan out when two or more arguments have calls in them
+        if sum(isinstance(node, (CaplispFuncall, CaplispList)) for node in nodes) < 2:
+            return [await node.eval_async(environment, self) for node in nodes]
+        return list(await asyncio.gather(*[node.eval_async(environment, self) for node in nodes]))
+
+    async def call(self, func: typing.Callable, args: list) -> Any:
+        if func in PURE_OPERATORS or isinstance(func, PureFunction) and func.cached(args):
+            return func(*args)
+        async with self.limit:
+            if inspect.iscoroutinefunction(func):
+                return await func(*args)
+            result = await asyncio.get_running_loop().run_in_executor(self.executor, functools.partial(func, *args))
+            if inspect.isawaitable(result):
+                result = await result
+            return result
+
+
+class SlottedExpression:
+    """
+    A compiled Caplisp expression whose variables have been resolved to fixed slots.
+
+    Caplisp has no binding forms, so every variable is free. Each distinct name gets a slot, in order of first
+    appearance, and the compiled code indexes into a tuple (or any sequence) instead of hashing names. That is no
+    measurable win over compile() by name: CPython strings cache their hash, so a dict lookup costs about as much
+    as indexing a tuple (see benchmarks/caplisp_compile.py), and eval, which binds the slots first, is slower.
+    What slots buy is the sharing below, and a calling convention for callers whose records are already sequences.
+
+    With share, a pure call that appears more than once in the tree is computed once per evaluation, into a slot of
+    its own after the variables.
+    """
+    def __init__(self, node: CaplispNode, share: bool = True):
+        self.names = tuple(dict.fromkeys(node.variables()))
+        self.slots = {name: index for index, name in enumerate(self.names)}
+        self.shared = ()
+        if share:
+            node, shared = self.share(node)
+            if shared:
+                slots = dict(self.slots)
+                for placeholder, _ in shared:
+                    slots[placeholder.id] = len(slots)
+                self.shared = tuple(subtree for _, subtree in shared)
+                codes = tuple(subtree.compile(slots) for subtree in self.shared)
+                main = node.compile(slots)
+
+                def code(values):
+                    values = list(values)
+                    for subtree in codes:
+                        values.append(subtree(values))
+                    return main(values)
+                self.code = code
+        if not self.shared:
+            self.code = node.compile(self.slots)
+        # itemgetter on several names already returns a tuple; with one or none we have to build it ourselves
+        if len(self.names) > 1:
+            self.bind = operator.itemgetter(*self.names)
+
+    def bind(self, environment: dict[str, Any]) -> tuple:
+        """
+        Look up each variable once, giving the slot tuple the compiled code expects.
+        """
+        return tuple(environment[name] for name in self.names)
+
+    def __call__(self, slots: typing.Sequence[Any]) -> Any:
+        return self.code(slots)
+
+    def eval(self, environment: dict[str, Any]) -> Any:
+        return self.code(self.bind(environment))
+
+    @staticmethod
+    def share(tree: CaplispNode) -> tuple[CaplispNode, list[tuple[CaplispVariable, CaplispNode]]]:
+        """
+        Find the pure calls that appear more than once in tree, and replace each with a placeholder variable.
+
+        :return: the rewritten tree, and the placeholders with the subtrees they stand for, innermost first
+        """
+        tree = CaplispInterner().intern(tree)
+        order = []
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            stack.extend(CaplispInterner.children(node))
+        # children before parents, each node once
+        order = list({id(node): node for node in reversed(order)}.values())
+
+        # a subtree counts as used twice only if two different parents refer to it
+        uses = collections.Counter(id(child) for node in order for child in CaplispInterner.children(node))
+
+        pure = {}
+        for node in order:
+            pure[id(node)] = isinstance(node, (CaplispConstant, CaplispVariable)) or \
+                isinstance(node, CaplispFuncall) and isinstance(node.func, CaplispFunctionReference) and \
+                is_pure(node.func.realfunc) and all(pure[id(a)] for a in node.args)
+
+        shared = []
+        rewritten = {}
+        for node in order:
+            children = CaplispInterner.children(node)
+            new = [rewritten[id(child)] for child in children]
+            if any(a is not b for a, b in zip(new, children)):
+                node_ = CaplispFuncall(new[0], *new[1:]) if isinstance(node, CaplispFuncall) else CaplispList(new)
+            else:
+                node_ = node
+            if isinstance(node, CaplispFuncall) and pure[id(node)] and uses[id(node)] > 1:
+                # '#' can't start a Python or Caplisp identifier, so the placeholders can't clash
+                placeholder = CaplispVariable(f'#{len(shared)}')
+                shared.append((placeholder, node_))
+                node_ = placeholder
+            rewritten[id(node)] = node_
+        return rewritten[id(tree)], shared
+
+
+class CaplispInterner:
+    """
+    A hash-consing table for Caplisp trees: structurally identical subtrees, across every program interned
+    through the same table, come out as one shared node.
+
+    Shared nodes must not be modified afterwards. The table keeps every node it has seen alive.
+    """
+    def __init__(self):
+        self.nodes: dict[tuple, CaplispNode] = {}
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def intern(self, tree: CaplispNode) -> CaplispNode:
+        """
+        :return: the shared copy of this tree, built from shared copies of its subtrees
+        """
+        order = []
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            stack.extend(self.children(node))
+
+        interned = {}
+        for original in reversed(order):
+            node = original
+            children = self.children(original)
+            shared = [interned[id(child)] for child in children]
+            if any(new is not old for new, old in zip(shared, children)):
+                node = CaplispFuncall(shared[0], *shared[1:]) if isinstance(node, CaplispFuncall) \
+                    else CaplispList(shared)
+            interned[id(original)] = self.intern_node(node)
+        return interned[id(tree)]
+
+    def intern_node(self, node: CaplispNode) -> CaplispNode:
+        """
+        Intern a single node whose children have already been interned.
+        """
+        if isinstance(node, CaplispConstant):
+            # the type keeps 1, 1.0 and True apart; repr keeps 0.0 and -0.0 apart
+            value = node.value
+            key = ('constant', type(value), repr(value) if isinstance(value, float) else value)
+        elif isinstance(node, CaplispVariable):
+            key = ('variable', node.id)
+        elif isinstance(node, CaplispFunctionReference):
+            key = ('reference', node.realfunc, node.name)
+        elif isinstance(node, CaplispFuncall):
+            key = ('funcall', id(node.func), tuple(map(id, node.args)))
+        elif isinstance(node, CaplispList):
+            key = ('list', tuple(map(id, node.elements)))
+        else:
+            return node
+
+        try:
+            return self.nodes.setdefault(key, node)
+        except TypeError:
+            # an unhashable constant; it just doesn't get shared
+            return node
+
+    @staticmethod
+    def children(node: CaplispNode) -> typing.Sequence[CaplispNode]:
+        if isinstance(node, CaplispFuncall):
+            return (node.func,) + tuple(node.args)
+        elif isinstance(node, CaplispList):
+            return node.elements
+        return ()
+
+
+class CaplispReader:
+    """
+    A single-pass reader for the S-expressions that CaplispNode.unparse produces.
+
+    Works on str, or on any bytes-like buffer (bytes, memoryview, mmap) without copying it; only the text of
+    each atom is decoded. A parenthesized form is a call, its head the function, and a bracketed one is a list.
+
+    Programs written before lists had brackets can be read with legacy=True. The old unparse wrote lists and calls
+    the same way, so a parenthesized form whose head is an operator, a variable or another call reads back as a
+    call, and anything else as a list. It also wrote strings without quotes, which come back as variables (or
+    numbers): that format can't tell them apart, so those programs need re-writing from their Python source.
+    """
+    # one group per kind of token; the last catches anything else, so that nothing is skipped silently
+    PATTERN = r"""(\()|(\))|(\[)|(\])|(b?(?:"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'))|([^\s()[\]'"]+)|(\S)"""
+    TEXT_TOKENS = re.compile(PATTERN)
+    BYTE_TOKENS = re.compile(PATTERN.encode())
+    OPEN, CLOSE, OPEN_LIST, CLOSE_LIST, STRING, ATOM, ERROR = range(1, 8)
+    LITERALS = {'True': True, 'False': False, 'None': None, '...': ...}
+    # numbers, and the signed inf, nan and complex numbers that CaplispConstant.unparse writes
+    NUMBER = re.compile(r'[-+]?\.?[0-9]|[-+]')
+
+    def __init__(self, source: typing.Union[str, bytes, memoryview, mmap.mmap],
+                 interner: typing.Optional[CaplispInterner] = None, legacy: bool = False):
+        self.source = source
+        self.text = isinstance(source, str)
+        self.interner = interner
+        self.legacy = legacy
+
+    def __iter__(self) -> typing.Iterator[CaplispNode]:
+        # each open form is the token that opened it and the list of its elements so far; iterative, so deep
+        # nesting is fine
+        stack = []
+        tokens = self.TEXT_TOKENS if self.text else self.BYTE_TOKENS
+        for match in tokens.finditer(self.source):
+            kind = match.lastindex
+            if kind == self.OPEN or kind == self.OPEN_LIST:
+                stack.append((kind, []))
+                continue
+            elif kind == self.CLOSE or kind == self.CLOSE_LIST:
+                if not stack or stack[-1][0] != kind - 1:
+                    raise ValueError(f"unbalanced {match.group()!r} at offset {match.start()}")
+                opened, elements = stack.pop()
+                if opened == self.OPEN_LIST or self.legacy and not self.callable_head(elements):
+                    node = CaplispList(elements)
+                elif elements:
+                    node = CaplispFuncall(elements[0], *elements[1:])
+                else:
+                    raise ValueError(f"a call with no function at offset {match.start()}")
+            elif kind == self.ATOM:
+                node = self.atom(match.group() if self.text else match.group().decode())
+            elif kind == self.STRING:
+                node = CaplispConstant(ast.literal_eval(match.group() if self.text else match.group().decode()))
+            else:
+                raise ValueError(f"unreadable Caplisp at offset {match.start()}")
+
+            if self.interner is not None:
+                # built bottom-up, so the children are shared already
+                node = self.interner.intern_node(node)
+            if stack:
+                stack[-1][1].append(node)
+            else:
+                yield node
+
+        if stack:
+            raise ValueError(f"unbalanced {'(' if stack[-1][0] == self.OPEN else '['!r} at end of input")
+
+    @staticmethod
+    def callable_head(elements: list[CaplispNode]) -> bool:
+        return bool(elements) and isinstance(elements[0], (CaplispFunctionReference, CaplispVariable, CaplispFuncall))
+
+    def atom(self, text: str) -> CaplispNode:
+        if text in OPERATOR_REFERENCES:
+            return OPERATOR_REFERENCES[text]
+        if text in self.LITERALS:
+            return CaplispConstant(self.LITERALS[text])
+        if self.NUMBER.match(text):
+            for number in (int, float, complex):
+                try:
+                    return CaplispConstant(number(text))
+                except ValueError:
+                    pass
+            raise ValueError(f"unreadable number {text!r}")
+        return CaplispVariable(text)
 
 
 class PythonToCaplisp(ast.NodeVisitor):
@@ -116,40 +713,14 @@ class PythonToCaplisp(ast.NodeVisitor):
         return CaplispVariable(node.id)
 
     def visit_BinOp(self, node: ast.BinOp) -> Any:
-        opmap = {ast.Add: operator.add,
-                 ast.Sub: operator.sub,
-                 ast.Mult: operator.mul,
-                 ast.MatMult: operator.matmul,
-                 ast.Div: operator.truediv,
-                 ast.Mod: operator.mod,
-                 ast.Pow: operator.pow,
-                 ast.LShift: operator.lshift,
-                 ast.RShift: operator.rshift,
-                 ast.BitOr: operator.or_,
-                 ast.BitXor: operator.xor,
-                 ast.BitAnd: operator.and_,
-                 ast.FloorDiv: operator.floordiv}
-        opnames = {ast.Add: '+',
-                 ast.Sub: '-',
-                 ast.Mult: '*',
-                 ast.MatMult: '@',
-                 ast.Div: '/',
-                 ast.Mod: '%',
-                 ast.Pow: '**',
-                 ast.LShift: '<<',
-                 ast.RShift: '>>',
-                 ast.BitOr: '|',
-                 ast.BitXor: '^',
-                 ast.BitAnd: '&',
-                 ast.FloorDiv: '//'}
-        func = CaplispFunctionReference(opmap[type(node.op)], opnames[type(node.op)])
+        func = OPERATOR_REFERENCES[OPNAMES[type(node.op)]]
         return CaplispFuncall(func, self.visit(node.left), self.visit(node.right))
 
     def visit_List(self, node: ast.List) -> Any:
         return CaplispList([self.visit(x) for x in node.elts])
 
     def visit_Call(self, node: ast.Call) -> Any:
-        return CaplispList([self.visit(node.func)] + [self.visit(arg) for arg in node.args])
+        return CaplispFuncall(self.visit(node.func), *[self.visit(arg) for arg in node.args])
 
     def generic_visit(self, node: ast.AST) -> Any:
         raise NotImplementedError
\ No newline at end of file
@@ -0,0 +1,162 @@
+"""
+A compact, versioned binary format for suspended executions.
+
+The layout is:
+
+  magic (3 bytes) | format version | flags | message pattern | continuation | environment
+
+The message pattern and continuation are varint-length-prefixed UTF-8; a pattern length of zero means None, so
+real lengths are stored plus one. The continuation is zlib-compressed when that makes it smaller, which is noted in
+the flags. The environment is a pickle that runs to the end of the buffer.
+
+With by_hash, the continuation field holds only the SHA-256 digest of the source (the REFERENCE flag), for stores
+that keep each distinct continuation once; decoding then needs a function to look the source up by its hex digest,
+which is the same as cps.cps.continuation_hash.
+
+A delta (see encode_delta) has the same layout, with the DELTA flag set and, in place of the environment, a pickle
+of the bindings that changed, the names that were deleted, and any changed bindings that came already pickled.
+
+Continuations are kept as source rather than as an encoded tree. Building AST nodes costs about the same whether
+they come from the parser or from a decoder, so the way to avoid it is not to build them at load time at all:
+resume parses through the continuation cache, and executions that share a continuation share one parse.
+"""
+import hashlib
+import pickle
+import zlib
+from typing import Any, Callable, Optional, Union
+
+MAGIC = b"CPS"
+# version 2 added the DELTA and REFERENCE flags, which a version 1 reader would ignore and so misread the state
+VERSION = 2
+
+COMPRESSED = 0x01
+DELTA = 0x02
+REFERENCE = 0x04
+# the flags each version knows about; any other bit means the state was written by something newer
+KNOWN_FLAGS = {1: COMPRESSED, 2: COMPRESSED | DELTA | REFERENCE}
+
+# below this, zlib's header and checksum cost more than they save
+COMPRESS_THRESHOLD = 64
+
+
+def _uvarint(buffer: bytearray, n: int):
+    while n > 0x7f:
+        buffer.append((n & 0x7f) | 0x80)
+        n >>= 7
+    buffer.append(n)
+
+
+def _read_uvarint(buffer: memoryview, position: int) -> tuple[int, int]:
+    result = shift = 0
+    while True:
+        b = buffer[position]
+        position += 1
+        result |= (b & 0x7f) << shift
+        if b < 0x80:
+            return result, position
+        shift += 7
+
+
+def encode_state(environment: dict[str, Any], continuation: str, message_pattern: Optional[str],
+                 by_hash: bool = False) -> bytes:
+    return _encode(REFERENCE if by_hash else 0, environment, continuation, message_pattern)
+
+
+def encode_delta(changed: dict[str, Any], deleted: tuple[str, ...], continuation: str,
+                 message_pattern: Optional[str], by_hash: bool = False,
+                 pickled: Optional[dict[str, bytes]] = None) -> bytes:
+    """
+    Encode the step from one saved state to the next: the bindings that changed, the names that went away, and the
+    new continuation and pattern.
+
+    :param pickled: more changed bindings, whose values the caller has pickled already
+    """
+    return _encode(DELTA | (REFERENCE if by_hash else 0), (changed, deleted, pickled or {}), continuation,
+                   message_pattern)
+
+
+def _encode(flags: int, payload: Any, continuation: str, message_pattern: Optional[str]) -> bytes:
+    code = continuation.encode()
+    if flags & REFERENCE:
+        code = hashlib.sha256(code).digest()
+    elif len(code) >= COMPRESS_THRESHOLD:
+        compressed = zlib.compress(code)
+        if len(compressed) < len(code):
+            code = compressed
+            flags |= COMPRESSED
+
+    buffer = bytearray(MAGIC)
+    buffer.append(VERSION)
+    buffer.append(flags)
+    if message_pattern is None:
+        _uvarint(buffer, 0)
+    else:
+        pattern = message_pattern.encode()
+        _uvarint(buffer, len(pattern) + 1)
+        buffer += pattern
+    _uvarint(buffer, len(code))
+    buffer += code
+    buffer += pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL)
+    return bytes(buffer)
+
+
+def decode_state(buffer: Union[bytes, bytearray, memoryview],
+                 resolve: Optional[Callable[[str], str]] = None) -> tuple[dict[str, Any], str, Optional[str]]:
+    """
+    Decode a buffer made by encode_state, without copying it first.
+
+    :param resolve: looks up a continuation's source by its hex digest, for states encoded by_hash
+    :return: the environment, the continuation source and the message pattern
+    """
+    flags, environment, continuation, message_pattern = _decode(buffer, resolve)
+    if flags & DELTA:
+        raise ValueError("this is a delta, not a whole execution state")
+    return environment, continuation, message_pattern
+
+
+def decode_delta(buffer: Union[bytes, bytearray, memoryview], resolve: Optional[Callable[[str], str]] = None) \
+        -> tuple[dict[str, Any], tuple[str, ...], str, Optional[str]]:
+    """
+    Decode a buffer made by encode_delta.
+
+    :return: the changed bindings, the deleted names, the continuation source and the message pattern
+    """
+    flags, payload, continuation, message_pattern = _decode(buffer, resolve)
+    if not flags & DELTA:
+        raise ValueError("this is a whole execution state, not a delta")
+    changed, deleted, pickled = payload
+    for name, data in pickled.items():
+        changed[name] = pickle.loads(data)
+    return changed, deleted, continuation, message_pattern
+
+
+def _decode(buffer: Union[bytes, bytearray, memoryview],
+            resolve: Optional[Callable[[str], str]]) -> tuple[int, Any, str, Optional[str]]:
+    buffer = memoryview(buffer)
+    if buffer[:3] != MAGIC:
+        raise ValueError("not an execution state")
+    if len(buffer) < 5 or buffer[3] not in KNOWN_FLAGS:
+        raise ValueError(f"unsupported execution state version {buffer[3] if len(buffer) > 3 else None}")
+    flags = buffer[4]
+    if flags & ~KNOWN_FLAGS[buffer[3]]:
+        raise ValueError(f"unsupported execution state flags {flags:#04x} for version {buffer[3]}")
+
+    length, position = _read_uvarint(buffer, 5)
+    message_pattern = None
+    if length:
+        message_pattern = str(buffer[position:position + length - 1], "utf-8")
+        position += length - 1
+
+    length, position = _read_uvarint(buffer, position)
+    code = buffer[position:position + length]
+    if len(code) < length:
+        raise ValueError("truncated execution state")
+    position += length
+    if flags & REFERENCE:
+        if resolve is None:
+            raise ValueError("this state refers to its continuation by hash, and there is nothing to look it up in")
+        continuation = resolve(code.hex())
+    else:
+        continuation = str(zlib.decompress(code) if flags & COMPRESSED else code, "utf-8")
+
+    return flags, pickle.loads(buffer[position:]), continuation, message_pattern
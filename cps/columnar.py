@@ -0,0 +1,167 @@
+"""
+Backends for evaluating a Caplisp expression over a whole batch of rows at once (see CaplispNode.eval_batch).
+
+A value during batch evaluation is either a column, with one entry per row, or a scalar that holds for every row.
+Constants and functions stay scalars, so a subexpression that doesn't depend on any column is computed once for the
+batch. With NumPy, columns are arrays and the operator functions run as ufuncs; without it, or for functions we know
+nothing about, the call is made once per row.
+"""
+import itertools
+import operator
+from typing import Any, Sequence
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class PythonBatch:
+    """
+    Columns are lists. Without NumPy there is nothing to vectorize with, but the tree is still walked once per batch
+    rather than once per row, and each call is a single map.
+    """
+    def __init__(self, size: int):
+        self.size = size
+
+    def is_column(self, value: Any) -> bool:
+        return isinstance(value, list)
+
+    def column(self, value: Any) -> Any:
+        # any sequence given as input is a column; anything else is a scalar
+        if isinstance(value, (str, bytes)) or not isinstance(value, Sequence) and not _is_array(value):
+            return value
+        value = value.tolist() if _is_array(value) else list(value)
+        if len(value) != self.size:
+            raise ValueError(f"column has {len(value)} rows, expected {self.size}")
+        return value
+
+    def broadcast(self, value: Any) -> Any:
+        return value if self.is_column(value) else [value] * self.size
+
+    def apply(self, func: Any, args: list[Any]) -> Any:
+        if not self.is_column(func) and not any(self.is_column(arg) for arg in args):
+            return func(*args)
+        return self.per_row(func, args)
+
+    def per_row(self, func: Any, args: list[Any]) -> list:
+        args = [arg if self.is_column(arg) else itertools.repeat(arg, self.size) for arg in args]
+        if self.is_column(func):
+            return [f(*row) for f, *row in zip(func, *args)] if args else [f() for f in func]
+        return list(map(func, *args)) if args else [func() for _ in range(self.size)]
+
+
+def _is_array(value: Any) -> bool:
+    return numpy is not None and isinstance(value, numpy.ndarray)
+
+
+class NumpyBatch(PythonBatch):
+    """
+    Columns are one-dimensional NumPy arrays, and operators become ufuncs.
+
+    Only columns of signed integers and floats (and int or float scalars) go through a ufunc: booleans add up as
+    integers in Python but not in NumPy, and unsigned integers wrap below zero. Arithmetic errors are raised rather
+    than turned into inf or nan, and an integer result that could have overflowed int64 (or an integer division
+    NumPy would round differently) is redone in Python, so the answer is always the one eval would give; the slow
+    path is one call per row, on Python numbers.
+    """
+    VECTORIZED = {}
+    # integers beyond these magnitudes may have wrapped (or, dividing, lost precision differently from Python)
+    INT_LIMIT = 2.0 ** 62
+    EXACT_FLOAT_LIMIT = 2 ** 53
+
+    def __init__(self, size: int):
+        super().__init__(size)
+        if not self.VECTORIZED:
+            NumpyBatch.VECTORIZED = {operator.add: numpy.add,
+                                     operator.sub: numpy.subtract,
+                                     operator.mul: numpy.multiply,
+                                     operator.truediv: numpy.true_divide,
+                                     operator.floordiv: numpy.floor_divide,
+                                     operator.mod: numpy.mod,
+                                     operator.pow: numpy.power,
+                                     operator.or_: numpy.bitwise_or,
+                                     operator.xor: numpy.bitwise_xor,
+                                     operator.and_: numpy.bitwise_and}
+
+    def is_column(self, value: Any) -> bool:
+        return isinstance(value, numpy.ndarray)
+
+    def column(self, value: Any) -> Any:
+        if self.is_column(value):
+            if len(value) != self.size:
+                raise ValueError(f"column has {len(value)} rows, expected {self.size}")
+            return value
+        value = super().column(value)
+        return self.array(value) if isinstance(value, list) else value
+
+    def broadcast(self, value: Any) -> Any:
+        return value if self.is_column(value) else self.array([value] * self.size)
+
+    def apply(self, func: Any, args: list[Any]) -> Any:
+        ufunc = None if self.is_column(func) else self.VECTORIZED.get(func)
+        if ufunc is not None and any(self.is_column(arg) for arg in args) and all(map(self.numeric, args)):
+            try:
+                with numpy.errstate(all='raise'):
+                    result = ufunc(*args)
+                    if self.exact(ufunc, args, result):
+                        return result
+            except (TypeError, ValueError, ArithmeticError):
+                # e.g. integers to a negative power, or dividing by zero: let Python decide, row by row
+                pass
+        return super().apply(func, args)
+
+    def numeric(self, value: Any) -> bool:
+        if self.is_column(value):
+            return value.dtype.kind in 'if'
+        return type(value) in (int, float)
+
+    def exact(self, ufunc: Any, args: list[Any], result: Any) -> bool:
+        """
+        Check that NumPy's fixed-width integers gave the same result Python's integers would have.
+        """
+        integers = [arg for arg in args if self.is_column(arg) and arg.dtype.kind == 'i' or type(arg) is int]
+        if not integers:
+            return True
+        if ufunc is numpy.true_divide:
+            # Python divides integers exactly and then rounds; NumPy rounds each to a float first
+            return all(numpy.all(numpy.abs(arg) < self.EXACT_FLOAT_LIMIT) for arg in integers)
+        if result.dtype.kind != 'i' or ufunc not in (numpy.add, numpy.subtract, numpy.multiply, numpy.power,
+                                                     numpy.floor_divide):
+            return True
+        # do it again in floats, which don't wrap; if that comes anywhere near the int64 range, we can't trust it
+        approximate = ufunc(*[arg.astype(numpy.float64) if self.is_column(arg) else float(arg) for arg in args])
+        return bool(numpy.all(numpy.abs(approximate) < self.INT_LIMIT))
+
+    def per_row(self, func: Any, args: list[Any]) -> Any:
+        # tolist gives back Python numbers, so each call behaves exactly as it would under eval
+        args = [arg.tolist() if self.is_column(arg) else itertools.repeat(arg, self.size) for arg in args]
+        if self.is_column(func):
+            return self.array([f(*row) for f, *row in zip(func.tolist(), *args)] if args else [f() for f in func])
+        return self.array(list(map(func, *args)) if args else [func() for _ in range(self.size)])
+
+    def array(self, values: list) -> Any:
+        result = None
+        # NumPy would find a common type for mixed rows (ints and floats become floats, numbers next to strings become
+        # strings), and then the answers would no longer be eval's; only rows all of one type get a typed array
+        if len(set(map(type, values))) <= 1:
+            try:
+                result = numpy.array(values)
+            except ValueError:
+                pass
+        if result is None or result.ndim != 1:
+            # rows of mixed types, or rows that are themselves sequences (or ragged), stay Python objects
+            result = numpy.empty(len(values), dtype=object)
+            result[:] = values
+        return result
+
+
+def batch_for(size: int, use_numpy: bool = None) -> PythonBatch:
+    """
+    :param use_numpy: True to insist on NumPy, False to avoid it, None to use it if it is installed
+    """
+    if use_numpy is None:
+        use_numpy = numpy is not None
+    if use_numpy and numpy is None:
+        raise ImportError("batch evaluation with use_numpy=True needs numpy")
+    return NumpyBatch(size) if use_numpy else PythonBatch(size)
@@ -88,10 +88,28 @@ For my application, either the module returns a continuation to be saved, or it
 """
 
 import ast
+import hashlib
 from typing import Any, NamedTuple, Optional, Union
 
 import asteval as asteval
 
+from cps import codec
+from cps.cache import LRUCache
+
+# parsed continuations, keyed by the hash of their source; many executions share the same continuation text
+continuation_cache = LRUCache(maxsize=1024)
+
+
+def continuation_hash(continuation: str) -> str:
+    return hashlib.sha256(continuation.encode()).hexdigest()
+
+
+def parse_continuation(continuation: str) -> ast.Module:
+    """
+    Parse the continuation source, or fetch it from the cache if some execution has already parsed it.
+    """
+    return continuation_cache.get(continuation_hash(continuation), lambda: ast.parse(continuation))
+
 
 class CapabilityExecutionState(NamedTuple):
     environment: dict
@@ -99,61 +117,73 @@ class CapabilityExecutionState(NamedTuple):
     message_pattern: str
 
     @staticmethod
-    def load(self, state: str) -> "CapabilityExecutionState":
+    def load(state: Union[bytes, memoryview]) -> "CapabilityExecutionState":
         """
-        Load this capability execution state from the persisted string.
+        Load this capability execution state from the persisted bytes.
 
         :param state:  the freeze-dried state of this execution
-        :return: a
+        :return: a CapabilityExecutionState ready to resume
         """
-        pass
+        return CapabilityExecutionState(*codec.decode_state(state))
 
-    def resume(self, message) -> Union[Any, "CapabilityExecutionState"]:
+    def resume(self, message, raise_errors: bool = False) -> Union[Any, "CapabilityExecutionState"]:
         """
         Do whatever work can be done on this execution in response to this message
         before we return to a waiting state.
 
+        :param raise_errors: raise an error in the continuation, rather than leaving asteval to report it and
+                             return None
         :return: a new CapabilityExecutionState for the next step
         """
-        # Step 1: parse the continuation back to an AST
-        tree = ast.parse(self.continuation)
+        # Step 1: parse the continuation back to an AST (or pick up the one we parsed last time)
+        tree = parse_continuation(self.continuation)
 
         # Step 2: evaluate to the next step
-        self.partial_evaluate(tree, message, self.environment)
+        return self.partial_evaluate(tree, message, self.environment, raise_errors)
 
-    def partial_evaluate(self, tree: ast.Module, msg: Any, environment: dict[str,Any]):
+    def partial_evaluate(self, tree: ast.Module, msg: Any, environment: dict[str,Any], raise_errors: bool = False):
         # As a rule of thumb, whenever start, we wind up with a Module node. Inside that Module,
         # we can safely assume there is a body with a single element, which is a lambda expression.
         # We need to pass the 'msg' to that lambda expression to evaluate the next step, so we must
         # now wrap it in a Call.
         call_lambda = ast.Expr(ast.Call(func=tree.body[0].value, args=[ast.Constant(value=msg)], keywords=[]))
 
-        # now we can proceed with evaluation
-        return asteval.Interpreter(symtable=self.expand_environment(environment)).run(call_lambda)
+        # now we can proceed with evaluation, in a copy of the environment: asteval binds its own names (print, the
+        # lambda's parameters) in the symbol table, and they must not end up in the state when it is persisted
+        interpreter = asteval.Interpreter(symtable=dict(self.expand_environment(environment)))
+        result = interpreter.run(call_lambda)
+        if raise_errors and interpreter.error:
+            # the first error is where it went wrong; asteval keeps the original exception if there was one
+            error = interpreter.error[0]
+            exception = error.exc_info[1]
+            if not isinstance(exception, error.exc or Exception):
+                exception = (error.exc or RuntimeError)(error.msg)
+            raise exception
+        return result
 
     def expand_environment(self, env: dict[str, Any]) -> dict[str, Any]:
         # Augment the environment we received by adding in the functions we understand
         # TODO: implement this
         return env
 
-    def persist(self) -> str:
+    def persist(self) -> bytes:
         """
-        Persist this capability execution state to a string that can be saved somewhere else, such as a database.
+        Persist this capability execution state to bytes that can be saved somewhere else, such as a database.
 
         :return: the capability execution state
         """
         # TODO: make sure to remove the functions we understand from the environment
-
-        pass
+        return codec.encode_state(self.environment, self.continuation, self.message_pattern)
 
 
 class CapabilityDefinition:
     def __init__(self, code):
         self.code = code
 
-    def execute(self) -> Union[Any, CapabilityExecutionState]:
+    def execute(self, environment: Optional[dict[str, Any]] = None) -> Union[Any, CapabilityExecutionState]:
         """
         Execute the initial work of this capability definition and return a new CapabilityExecutionState.
+        :param environment: the initial bindings, such as the *_cps builtins the code calls; blank by default
         :return: the execution, as it is after completing its first steps
         """
 
@@ -166,9 +196,9 @@ class CapabilityDefinition:
         # Step 3: unparse the CPS-transformed code
         cps_code = ast.unparse(cps_transformed)
 
-        # Step 4: using a blank initial environment, we now have an initial
+        # Step 4: using the initial environment, we now have an initial
         # capability execution state
-        initial_state = CapabilityExecutionState({}, cps_code, None)
+        initial_state = CapabilityExecutionState(dict(environment or {}), cps_code, None)
 
         # Step 5: evaluate the initial state and return the result
         return initial_state.resume(None)
@@ -225,65 +255,60 @@ def dump(node):
 
 
 class LInterpreter(asteval.Interpreter):
-    def __init__(self, symtable=None, usersyms=None, writer=None,
-                 err_writer=None, use_numpy=True, minimal=False,
-                 no_if=False, no_for=False, no_while=False, no_try=False,
-                 no_functiondef=False, no_ifexp=False, no_listcomp=False,
-                 no_augassign=False, no_assert=False, no_delete=False,
-                 no_raise=False, no_print=False, max_time=None,
-                 readonly_symbols=None, builtins_readonly=False):
-        super().__init__(symtable, usersyms, writer,
-                         err_writer, use_numpy, minimal,
-                         no_if, no_for, no_while, no_try,
-                         no_functiondef, no_ifexp, no_listcomp,
-                         no_augassign, no_assert, no_delete,
-                         no_raise, no_print, max_time,
-                         readonly_symbols, builtins_readonly)
+    def __init__(self, symtable=None, **kwargs):
+        super().__init__(symtable, **kwargs)
         self.node_handlers['lambda'] = self.on_lambda
 
     def on_lambda(self, node: ast.Lambda):
         return node
 
+    @staticmethod
+    def parameter_names(func: ast.Lambda) -> tuple[str, ...]:
+        # worked out once per lambda node; cached continuations share their nodes, so this survives across resumes
+        try:
+            return func.parameter_names
+        except AttributeError:
+            func.parameter_names = tuple(arg.arg for arg in func.args.args)
+            return func.parameter_names
+
     def on_call(self, node: ast.Call):
         # if the function is a lambda, we start processing it here
         # otherwise, we refer to the parent
         func = self.run(node.func)
-        if isinstance(func, ast.Lambda):
-            # this is all repetition of work done in on_call in the parent class
-            args = [self.run(targ) for targ in node.args]
-            starargs = getattr(node, 'starargs', None)
-            if starargs is not None:
-                args = args + self.run(starargs)
-
-            keywords = {}
-            if func == print:
-                keywords['file'] = self.writer
-            for key in node.keywords:
-                if not isinstance(key, ast.keyword):
-                    msg = "keyword error in function call '%s'" % (func)
-                    self.raise_exception(node, msg=msg)
-                if key.arg is None:
-                    keywords.update(self.run(key.value))
-                elif key.arg in keywords:
-                    self.raise_exception(node,
-                                         msg="keyword argument repeated: %s" % key.arg,
-                                         exc=SyntaxError)
+        if not isinstance(func, ast.Lambda):
+            # hand the parent the function we already have, rather than letting it evaluate node.func again
+            return super().on_call(ast.copy_location(
+                ast.Call(func=ast.Constant(value=func), args=node.args, keywords=node.keywords), node))
+
+        names = self.parameter_names(func)
+        if len(node.args) > len(names):
+            self.raise_exception(node, exc=TypeError,
+                                 msg=f"lambda takes {len(names)} arguments but {len(node.args)} were given")
+        bindings = dict(zip(names, [self.run(arg) for arg in node.args]))
+        for key in node.keywords:
+            if key.arg is None or key.arg not in names or key.arg in bindings:
+                self.raise_exception(node, exc=TypeError, msg=f"bad keyword argument to lambda: {key.arg}")
+            bindings[key.arg] = self.run(key.value)
+        if len(bindings) != len(names):
+            self.raise_exception(node, exc=TypeError,
+                                 msg=f"lambda takes {len(names)} arguments but {len(bindings)} were given")
+
+        # push a frame: only the parameters are bound, and whatever they shadow is put back afterwards
+        saved = {name: self.symtable.get(name, _UNBOUND) for name in names}
+        self.symtable.update(bindings)
+        try:
+            return self.run(func.body)
+        finally:
+            for name, value in saved.items():
+                if value is _UNBOUND:
+                    self.symtable.pop(name, None)
                 else:
-                    keywords[key.arg] = self.run(key.value)
+                    self.symtable[name] = value
 
-            kwargs = getattr(node, 'kwargs', None)
 
-            if kwargs is not None:
-                keywords.update(self.run(kwargs))
+# marks a name that had no binding before a lambda's frame was pushed
+_UNBOUND = object()
 
-            # now we have the arguments and the func, so we must evaluate the body of the lambda with
-            # the new environment
-            old_table = self.symtable.copy()
-            for name, value in zip(node.func.args.args, args):
-                self.symtable[name.arg] = value
-            retval = self.run(node.func.body)
-            self.symtable = old_table
-            return retval
 
 def main():
     #simple2_ast = ast.parse(inspect.getsource(simple2))
@@ -0,0 +1,248 @@
+"""
+Keeping only the recently active suspended executions in memory.
+
+Most executions wait a long time between messages, so a HibernationManager holds the most recently used ones in an
+LRU, up to a count and a memory budget, and hibernates the rest to an ExecutionStore. Waking an execution that has
+been hibernated loads it back. SimPy continuations (Lambda objects) go through the same persistence path as
+CapabilityExecutionState, by way of freeze and thaw.
+"""
+import ast
+import collections
+import sys
+import time
+from typing import Any, Callable, NamedTuple, Optional, Union
+
+from cps.cps import CapabilityExecutionState, parse_continuation
+from cps.simpy import Lambda
+from cps.store import ExecutionStore
+
+# marks a frozen SimPy continuation, and records whether it was trampolined
+TRAMPOLINE = "__trampoline"
+
+Execution = Union[CapabilityExecutionState, Lambda]
+
+
+class HostFunction(NamedTuple):
+    """
+    Stands in for one of the host's functions bound under some other name (a Preempted continuation's pending call,
+    say), until thaw puts it back.
+    """
+    name: str
+
+
+def freeze(continuation: Lambda, functions: Optional[dict[str, Any]] = None,
+           message_pattern: Optional[str] = None) -> CapabilityExecutionState:
+    """
+    Turn a SimPy continuation into an execution state that can be persisted.
+
+    :param functions: bindings that belong to the host rather than to the execution (usually functions that can't be
+                      pickled); they are left out, and thaw puts them back. That goes for the continuations bound in
+                      the environment too, however deeply nested, but not for other containers
+    """
+    functions = functions or {}
+    names = {id(function): name for name, function in functions.items()}
+    environment = _strip(continuation.environment.flatten(), functions, names, {})
+    environment[TRAMPOLINE] = continuation.trampoline
+    source = ast.unparse(ast.Lambda(args=continuation.args, body=continuation.body))
+    return CapabilityExecutionState(environment, source, message_pattern)
+
+
+def _strip(bindings: dict[str, Any], functions: dict[str, Any], names: dict[int, str],
+           copies: dict[int, Lambda]) -> dict[str, Any]:
+    stripped = {}
+    for name, value in bindings.items():
+        if name in functions and functions[name] is value:
+            continue
+        if id(value) in names and functions[names[id(value)]] is value:
+            value = HostFunction(names[id(value)])
+        elif isinstance(value, Lambda):
+            if id(value) not in copies:
+                # copied before its bindings are, so a continuation that binds itself doesn't recurse forever
+                copy = copies[id(value)] = type(value)(value.args, value.body, {}, value.trampoline)
+                copy.environment.bindings.update(_strip(value.environment.flatten(), functions, names, copies))
+            value = copies[id(value)]
+        stripped[name] = value
+    return stripped
+
+
+def thaw(state: CapabilityExecutionState, functions: Optional[dict[str, Any]] = None) -> Lambda:
+    """
+    Rebuild the continuation that freeze was given.
+    """
+    functions = functions or {}
+    environment = _restore(state.environment, functions, {})
+    trampoline = environment.pop(TRAMPOLINE)
+    tree = parse_continuation(state.continuation).body[0].value
+    return Lambda(tree.args, tree.body, environment, trampoline)
+
+
+def _restore(bindings: dict[str, Any], functions: dict[str, Any], copies: dict[int, Lambda]) -> dict[str, Any]:
+    restored = dict(functions)
+    for name, value in bindings.items():
+        if isinstance(value, HostFunction):
+            value = functions[value.name]
+        elif isinstance(value, Lambda):
+            if id(value) not in copies:
+                copy = copies[id(value)] = type(value)(value.args, value.body, {}, value.trampoline)
+                copy.environment.bindings.update(_restore(value.environment.flatten(), functions, copies))
+            value = copies[id(value)]
+        restored[name] = value
+    return restored
+
+
+def estimate_size(execution: Execution) -> int:
+    """
+    A rough, cheap estimate of the memory an execution holds: its bindings and their values, one level deep.
+    """
+    environment = execution.environment
+    if isinstance(execution, Lambda):
+        environment = environment.flatten()
+    size = sys.getsizeof(environment)
+    for value in environment.values():
+        size += sys.getsizeof(value)
+        if isinstance(value, (list, tuple, set, frozenset)):
+            size += sum(sys.getsizeof(item) for item in value)
+        elif isinstance(value, dict):
+            size += sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in value.items())
+    return size
+
+
+class HibernationManager:
+    def __init__(self, store: ExecutionStore, max_resident: int = 10_000, memory_budget: Optional[int] = None,
+                 functions: Optional[dict[str, Any]] = None,
+                 sizer: Callable[[Execution], int] = estimate_size):
+        """
+        :param store: where hibernated executions go
+        :param max_resident: how many executions may stay in memory
+        :param memory_budget: if given, how many bytes (as estimated by sizer) resident executions may hold
+        :param functions: host bindings to leave out of frozen SimPy continuations (see freeze)
+        """
+        if max_resident < 0:
+            raise ValueError(f"max_resident must not be negative, not {max_resident}")
+        self.store = store
+        self.max_resident = max_resident
+        self.memory_budget = memory_budget
+        self.functions = functions or {}
+        self.sizer = sizer
+        # id -> (execution, estimated size, when it was last parked or woken), least recently used first
+        self.resident: collections.OrderedDict[str, tuple[Execution, int, float]] = collections.OrderedDict()
+        self.resident_bytes = 0
+        self.hibernating: set[str] = set()
+        # resident executions that failed to hibernate (they couldn't be persisted), which shrinking passes over
+        self.pinned: set[str] = set()
+        self.evictions = 0
+        self.rehydrations = 0
+        # the most recent rehydration times, in seconds
+        self.latencies = collections.deque(maxlen=1000)
+
+    def __len__(self) -> int:
+        return len(self.resident) + len(self.hibernating)
+
+    def __contains__(self, execution_id: str) -> bool:
+        return execution_id in self.resident or execution_id in self.hibernating
+
+    def park(self, execution_id: str, execution: Execution):
+        """
+        Keep an execution until its next message, in memory for now, replacing whatever was parked under this id.
+        """
+        self.discard(execution_id)
+        size = self.sizer(execution)
+        self.resident[execution_id] = (execution, size, time.monotonic())
+        self.resident_bytes += size
+        self.shrink()
+
+    def wake(self, execution_id: str) -> Execution:
+        """
+        Take an execution back out, loading it from the store if it was hibernated. Park it again if it suspends.
+
+        :raises KeyError: if nothing is parked under this id
+        """
+        if execution_id in self.resident:
+            execution, size, _ = self.resident.pop(execution_id)
+            self.resident_bytes -= size
+            self.pinned.discard(execution_id)
+            return execution
+        if execution_id not in self.hibernating:
+            raise KeyError(execution_id)
+
+        start = time.perf_counter()
+        state = self.store.load(execution_id)
+        execution = thaw(state, self.functions) if TRAMPOLINE in state.environment else state
+        self.store.delete(execution_id)
+        self.hibernating.discard(execution_id)
+        self.latencies.append(time.perf_counter() - start)
+        self.rehydrations += 1
+        return execution
+
+    def discard(self, execution_id: str):
+        """
+        Forget an execution, wherever it is.
+        """
+        if execution_id in self.resident:
+            self.resident_bytes -= self.resident.pop(execution_id)[1]
+            self.pinned.discard(execution_id)
+        elif execution_id in self.hibernating:
+            self.hibernating.discard(execution_id)
+            self.store.delete(execution_id)
+
+    def hibernate(self, execution_id: str):
+        """
+        Move one resident execution out to the store. If it can't be saved, it stays resident and the error is raised.
+        """
+        execution, size, _ = self.resident[execution_id]
+        state = freeze(execution, self.functions) if isinstance(execution, Lambda) else execution
+        self.store.save(execution_id, state)
+        del self.resident[execution_id]
+        self.resident_bytes -= size
+        self.hibernating.add(execution_id)
+        self.evictions += 1
+
+    def try_hibernate(self, execution_id: str) -> bool:
+        """
+        Hibernate an execution, pinning it in memory instead if it can't be saved.
+        """
+        try:
+            self.hibernate(execution_id)
+        except Exception:
+            self.pinned.add(execution_id)
+            return False
+        return True
+
+    def hibernate_idle(self, max_idle: float) -> int:
+        """
+        Hibernate every execution that hasn't been parked or woken for max_idle seconds.
+
+        :return: how many were hibernated
+        """
+        cutoff = time.monotonic() - max_idle
+        idle = []
+        # least recently used first, so we can stop at the first one that is still fresh
+        for execution_id, (_, _, touched) in self.resident.items():
+            if touched > cutoff:
+                break
+            idle.append(execution_id)
+        return sum(self.try_hibernate(execution_id) for execution_id in idle if execution_id not in self.pinned)
+
+    def shrink(self):
+        # least recently used first, passing over the ones that can't be hibernated
+        candidates = (execution_id for execution_id in list(self.resident) if execution_id not in self.pinned)
+        while len(self.resident) > self.max_resident or \
+                self.memory_budget is not None and self.resident_bytes > self.memory_budget:
+            execution_id = next(candidates, None)
+            if execution_id is None:
+                break
+            self.try_hibernate(execution_id)
+
+    def metrics(self) -> dict[str, Any]:
+        latencies = sorted(self.latencies)
+        return {
+            "resident": len(self.resident),
+            "resident_bytes": self.resident_bytes,
+            "hibernating": len(self.hibernating),
+            "pinned": len(self.pinned),
+            "evictions": self.evictions,
+            "rehydrations": self.rehydrations,
+            "rehydration_p50": latencies[len(latencies) // 2] if latencies else None,
+            "rehydration_p99": latencies[int(len(latencies) * 0.99)] if latencies else None,
+            "rehydration_max": latencies[-1] if latencies else None,
+        }
@@ -0,0 +1,262 @@
+"""
+An optimization pass for CPS-transformed programs.
+
+The CPS transforms wrap every statement in a fresh continuation, and many of those do nothing but pass their
+argument along. This pass shrinks the tree with a few local rewrites, repeated until nothing changes:
+
+  - constant folding: ``2 * 3`` becomes ``6``
+  - beta reduction: ``(lambda x: f(x, k))(y)`` becomes ``f(y, k)``, when the argument is a constant or a name, or a
+    lambda that is used at most once, and nothing in the body would capture it
+  - eta reduction: ``lambda _: k(_)`` becomes ``k``, and ``lambda: g()`` becomes ``g``
+  - ``lambda _: complete()`` becomes ``complete``, since complete ignores its arguments
+
+These rely on SimPy's semantics: evaluating a name or a lambda has no side effects, and bindings never change.
+"""
+import ast
+import copy
+import math
+import operator
+from typing import Any, Callable, Optional
+
+from cps.simpy import free_variables
+
+BINOPS = {ast.Add: operator.add,
+          ast.Sub: operator.sub,
+          ast.Mult: operator.mul,
+          ast.Div: operator.truediv,
+          ast.Mod: operator.mod,
+          ast.Pow: operator.pow,
+          ast.LShift: operator.lshift,
+          ast.RShift: operator.rshift,
+          ast.BitOr: operator.or_,
+          ast.BitXor: operator.xor,
+          ast.BitAnd: operator.and_,
+          ast.FloorDiv: operator.floordiv}
+
+UNARYOPS = {ast.UAdd: operator.pos,
+            ast.USub: operator.neg,
+            ast.Invert: operator.invert,
+            ast.Not: operator.not_}
+
+# folding is only worth it when the result stays small: this many characters, items or bits
+MAX_FOLDED_SIZE = 256
+
+
+def optimize(tree: ast.AST, complete: Optional[str] = "complete") -> ast.AST:
+    """
+    Rewrite a CPS program into a smaller one that computes the same thing. Like a NodeTransformer, this reuses the
+    nodes of the tree it is given.
+
+    :param complete: the name of the final continuation, which must ignore its arguments; None to leave it alone
+    :return: the optimized tree
+    """
+    size = count_nodes(tree)
+    while True:
+        tree = _bottom_up(tree, lambda node: _rewrite(node, complete))
+        # every rewrite removes nodes, so once the count stops falling there is nothing left to do
+        new_size = count_nodes(tree)
+        if new_size == size:
+            return tree
+        size = new_size
+
+
+def count_nodes(tree: ast.AST) -> int:
+    count = 0
+    stack = [tree]
+    while stack:
+        count += 1
+        stack.extend(ast.iter_child_nodes(stack.pop()))
+    return count
+
+
+def metrics(tree: ast.AST) -> dict[str, int]:
+    """
+    :return: the number of AST nodes, and the size of the continuation source we would have to persist
+    """
+    return {"nodes": count_nodes(tree), "size": len(ast.unparse(tree))}
+
+
+def _bottom_up(tree: ast.AST, rewrite: Callable[[ast.AST], ast.AST]) -> ast.AST:
+    # iterative, since CPS programs nest a lambda for every statement; in reversed pre-order every node comes after
+    # all of its descendants
+    order = []
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        order.append(node)
+        stack.extend(ast.iter_child_nodes(node))
+
+    replaced = {}
+    for node in reversed(order):
+        for field, value in ast.iter_fields(node):
+            if isinstance(value, list):
+                setattr(node, field, [replaced.get(id(item), item) for item in value])
+            elif isinstance(value, ast.AST):
+                setattr(node, field, replaced.get(id(value), value))
+        if isinstance(node, ast.Lambda):
+            # its body may have changed underneath it
+            node.__dict__.pop("free_variables", None)
+        replaced[id(node)] = rewrite(node)
+    return replaced[id(tree)]
+
+
+def _rewrite(node: ast.AST, complete: Optional[str]) -> ast.AST:
+    if isinstance(node, ast.BinOp):
+        if isinstance(node.left, ast.Constant) and isinstance(node.right, ast.Constant):
+            return _fold(node, BINOPS.get(type(node.op)), node.left.value, node.right.value)
+    elif isinstance(node, ast.UnaryOp):
+        if isinstance(node.operand, ast.Constant):
+            return _fold(node, UNARYOPS.get(type(node.op)), node.operand.value)
+    elif isinstance(node, ast.Call):
+        if isinstance(node.func, ast.Lambda):
+            return _beta(node)
+    elif isinstance(node, ast.Lambda):
+        return _eta(node, complete)
+    return node
+
+
+def _fold(node: ast.AST, op: Optional[Callable], *operands: Any) -> ast.AST:
+    if op is None:
+        return node
+    # don't let the optimizer be talked into building something enormous, like 'x' * 10**9 or 2 ** 10**9
+    if op in (operator.pow, operator.lshift, operator.mul) and any(
+            isinstance(v, int) and abs(v) > MAX_FOLDED_SIZE for v in operands[1:]):
+        return node
+    if op is operator.mul and isinstance(operands[0], int) and isinstance(operands[1], (str, bytes, tuple)) \
+            and abs(operands[0]) > MAX_FOLDED_SIZE:
+        return node
+    # nor into building a huge integer out of small steps, like (2 ** 256) ** 256
+    if all(type(v) is int for v in operands) and _bits(op, *operands) > MAX_FOLDED_SIZE:
+        return node
+    try:
+        value = op(*operands)
+    except Exception:
+        # leave it for run time, where the error belongs
+        return node
+    if isinstance(value, (str, bytes, tuple)) and len(value) > MAX_FOLDED_SIZE or \
+            isinstance(value, int) and value.bit_length() > MAX_FOLDED_SIZE:
+        return node
+    return ast.Constant(value=value)
+
+
+def _bits(op: Callable, *operands: int) -> int:
+    # an upper bound on the size of an integer result, before working it out
+    bits = [v.bit_length() for v in operands]
+    if op is operator.pow and len(operands) == 2 and operands[1] > 0:
+        return int(operands[1] * math.log2(abs(operands[0]))) + 1 if abs(operands[0]) > 1 else 1
+    if op is operator.lshift and len(operands) == 2:
+        return bits[0] + operands[1]
+    if op is operator.mul:
+        return sum(bits)
+    return max(bits) + 1
+
+
+def _simple_params(args: ast.arguments) -> Optional[list[str]]:
+    # plain positional parameters only
+    if args.posonlyargs or args.vararg or args.kwonlyargs or args.kwarg or args.defaults:
+        return None
+    return [arg.arg for arg in args.args]
+
+
+def _beta(call: ast.Call) -> ast.AST:
+    params = _simple_params(call.func.args)
+    if params is None or call.keywords or len(params) != len(call.args) or len(set(params)) != len(params):
+        return call
+
+    body = call.func.body
+    uses = _count_uses(body, params)
+    binders = _binders(body)
+    substitution = {}
+    for name, arg in zip(params, call.args):
+        if isinstance(arg, ast.Constant):
+            pass
+        elif isinstance(arg, ast.Name):
+            if arg.id in binders:
+                return call
+        elif isinstance(arg, ast.Lambda) and uses[name] <= 1:
+            if not free_variables(arg).isdisjoint(binders):
+                return call
+        else:
+            # anything else might do work, and must happen exactly once, in order
+            return call
+        substitution[name] = arg
+    return _substitute(body, substitution)
+
+
+def _eta(lam: ast.Lambda, complete: Optional[str]) -> ast.AST:
+    params = _simple_params(lam.args)
+    body = lam.body
+    if isinstance(body, ast.Expr):
+        # cps.CpsTransform leaves the statement wrapper on its continuation bodies
+        body = body.value
+    if params is None or not isinstance(body, ast.Call) or body.keywords or not isinstance(body.func, ast.Name):
+        return lam
+
+    if body.func.id == complete and not body.args:
+        return ast.Name(id=complete, ctx=ast.Load())
+
+    if body.func.id not in params and len(body.args) == len(params) and all(
+            isinstance(arg, ast.Name) and arg.id == param for arg, param in zip(body.args, params)):
+        return ast.Name(id=body.func.id, ctx=ast.Load())
+    return lam
+
+
+def _count_uses(body: ast.AST, params: list[str]) -> dict[str, int]:
+    uses = dict.fromkeys(params, 0)
+    stack = [(body, frozenset(params))]
+    while stack:
+        node, visible = stack.pop()
+        if isinstance(node, ast.Name) and node.id in visible:
+            uses[node.id] += 1
+        elif isinstance(node, ast.Lambda):
+            visible = visible - {arg.arg for arg in node.args.args}
+        stack.extend((child, visible) for child in ast.iter_child_nodes(node))
+    return uses
+
+
+def _binders(body: ast.AST) -> set[str]:
+    names = set()
+    for node in ast.walk(body):
+        if isinstance(node, ast.Lambda):
+            names.update(arg.arg for arg in node.args.args)
+    return names
+
+
+def _substitute(body: ast.AST, substitution: dict[str, ast.AST]) -> ast.AST:
+    # copy the body, putting the arguments in place of the parameters wherever a nested lambda hasn't shadowed them
+    result = [None]
+    stack = [(body, substitution, result, 0)]
+    while stack:
+        node, mapping, parent, index = stack.pop()
+        if isinstance(node, ast.Name) and node.id in mapping:
+            replacement = mapping[node.id]
+            # a lambda is only substituted where it is used once, so it can move; names and constants are copied
+            parent[index] = replacement if isinstance(replacement, ast.Lambda) else copy.copy(replacement)
+            continue
+
+        if isinstance(node, ast.Lambda):
+            mapping = {k: v for k, v in mapping.items() if k not in {arg.arg for arg in node.args.args}}
+        new = copy.copy(node)
+        new.__dict__.pop("free_variables", None)
+        parent[index] = new
+        for field, value in ast.iter_fields(node):
+            if isinstance(value, list):
+                items = list(value)
+                setattr(new, field, items)
+                stack.extend((item, mapping, items, i) for i, item in enumerate(value) if isinstance(item, ast.AST))
+            elif isinstance(value, ast.AST):
+                holder = _FieldSetter(new, field)
+                stack.append((value, mapping, holder, 0))
+    return result[0]
+
+
+class _FieldSetter:
+    # lets _substitute assign to a node's field the same way it assigns into a list
+    __slots__ = ("node", "field")
+
+    def __init__(self, node: ast.AST, field: str):
+        self.node = node
+        self.field = field
+
+    def __setitem__(self, index: int, value: Any):
+        setattr(self.node, self.field, value)
@@ -0,0 +1,105 @@
+"""
+Finding the suspended executions that are waiting on an incoming message.
+
+Message topics and patterns are dot-separated segments, as in ``orders.42.paid``. In a pattern, ``*`` matches
+exactly one segment and ``#`` matches any number of segments, including none, so ``orders.*.paid`` and
+``orders.#`` both match the topic above. Patterns without wildcards go in a hash table; the rest go in a trie
+keyed by segment, so dispatch only visits the branches that can match.
+"""
+from typing import Hashable
+
+from cps.cps import CapabilityExecutionState
+
+STAR = "*"
+HASH = "#"
+
+
+class _TrieNode:
+    __slots__ = ("children", "executions")
+
+    def __init__(self):
+        self.children = {}
+        self.executions = {}
+
+
+class MessageRouter:
+    def __init__(self):
+        self.exact: dict[str, dict[Hashable, CapabilityExecutionState]] = {}
+        self.root = _TrieNode()
+        self.patterns: dict[Hashable, str] = {}
+
+    def __len__(self) -> int:
+        return len(self.patterns)
+
+    def __contains__(self, execution_id: Hashable) -> bool:
+        return execution_id in self.patterns
+
+    def add(self, execution_id: Hashable, state: CapabilityExecutionState):
+        """
+        Park an execution until a message matching its pattern arrives, replacing whatever was parked under this id.
+        """
+        if state.message_pattern is None:
+            raise ValueError(f"execution {execution_id!r} is not waiting on any message")
+        if execution_id in self.patterns:
+            self.remove(execution_id)
+
+        pattern = state.message_pattern
+        self.patterns[execution_id] = pattern
+        segments = pattern.split(".")
+        if STAR not in segments and HASH not in segments:
+            self.exact.setdefault(pattern, {})[execution_id] = state
+            return
+
+        node = self.root
+        for segment in segments:
+            node = node.children.setdefault(segment, _TrieNode())
+        node.executions[execution_id] = state
+
+    def remove(self, execution_id: Hashable) -> CapabilityExecutionState:
+        pattern = self.patterns.pop(execution_id)
+        if pattern in self.exact:
+            waiting = self.exact[pattern]
+            state = waiting.pop(execution_id)
+            if not waiting:
+                del self.exact[pattern]
+            return state
+
+        path = [self.root]
+        segments = pattern.split(".")
+        for segment in segments:
+            path.append(path[-1].children[segment])
+        state = path[-1].executions.pop(execution_id)
+
+        # prune the branch back as far as it is empty, so a churn of patterns doesn't leave the trie bloated
+        for depth in range(len(segments), 0, -1):
+            node = path[depth]
+            if node.executions or node.children:
+                break
+            del path[depth - 1].children[segments[depth - 1]]
+        return state
+
+    def dispatch(self, topic: str) -> dict[Hashable, CapabilityExecutionState]:
+        """
+        :return: every parked execution whose pattern matches this topic, by execution id
+        """
+        matches = dict(self.exact.get(topic, {}))
+        segments = topic.split(".")
+        end = len(segments)
+
+        stack = [(self.root, 0)]
+        while stack:
+            node, position = stack.pop()
+            hash_child = node.children.get(HASH)
+            if hash_child is not None:
+                # '#' can swallow any number of the remaining segments
+                stack.extend((hash_child, i) for i in range(position, end + 1))
+            if position == end:
+                matches.update(node.executions)
+                continue
+            child = node.children.get(segments[position])
+            if child is not None:
+                stack.append((child, position + 1))
+            child = node.children.get(STAR)
+            if child is not None:
+                stack.append((child, position + 1))
+        return matches
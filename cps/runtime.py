@@ -0,0 +1,98 @@
+"""
+An asyncio runtime for driving many SimPy executions at once.
+
+Executions are evaluated in trampolined mode, and builtins may be coroutines (see SimPy.drive_async), so an
+execution waiting on I/O gives up the event loop instead of a thread.
+"""
+import asyncio
+import ast
+from typing import Any, Optional, Union
+
+from cps.simpy import Lambda, Preempted, Scope, SimPy, TailCall
+
+
+class AsyncRuntime:
+    def __init__(self, max_concurrent: int = 100, max_pending: int = 1000, fuel: Optional[int] = None):
+        """
+        :param max_concurrent: how many executions may be running (or awaiting I/O) at once
+        :param max_pending: how many executions may be submitted but not yet finished before submit waits
+        :param fuel: if given, how many steps an execution may take before it goes to the back of the queue
+        """
+        if max_pending < max_concurrent:
+            raise ValueError("max_pending must be at least max_concurrent")
+        self.max_concurrent = max_concurrent
+        self.fuel = fuel
+        self.queue = asyncio.Queue()
+        self.admission = asyncio.Semaphore(max_pending)
+        self.workers = []
+
+    async def __aenter__(self) -> "AsyncRuntime":
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.stop()
+
+    def start(self):
+        self.workers = [asyncio.create_task(self.work()) for _ in range(self.max_concurrent)]
+
+    async def stop(self):
+        """
+        Wait for everything submitted so far to finish, then shut the workers down.
+        """
+        await self.queue.join()
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    async def submit(self, node: ast.AST, env: Union[dict[str, Any], Scope]) -> asyncio.Future:
+        """
+        Queue a program to run, waiting first if too many executions are already pending.
+
+        :return: a future for the program's result, or for its continuation if it suspends
+        """
+        return await self.enqueue(TailCall(SimPy.eval, (node, env, True)))
+
+    async def resume(self, continuation: Lambda, *args: Any) -> asyncio.Future:
+        """
+        Queue a suspended continuation to be resumed with these arguments.
+        """
+        return await self.enqueue(TailCall(continuation, args))
+
+    async def run(self, node: ast.AST, env: Union[dict[str, Any], Scope]) -> Any:
+        return await (await self.submit(node, env))
+
+    async def enqueue(self, job: TailCall) -> asyncio.Future:
+        await self.admission.acquire()
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((job, future))
+        return future
+
+    async def work(self):
+        while True:
+            job, future = await self.queue.get()
+            finished = True
+            try:
+                result = await SimPy.drive_async(job, self.fuel)
+            except BaseException as e:
+                # a CancelledError may come from a builtin's own I/O, which only ends that job; the worker carries on
+                # unless it is the one being cancelled
+                if isinstance(e, asyncio.CancelledError):
+                    future.cancel()
+                elif not future.done():
+                    future.set_exception(e)
+                if asyncio.current_task().cancelling() or isinstance(e, (KeyboardInterrupt, SystemExit)):
+                    raise
+            else:
+                if isinstance(result, Preempted):
+                    # out of fuel: let everything already waiting have a turn before this one carries on; it
+                    # keeps its admission, since it was never finished
+                    self.queue.put_nowait((TailCall(result, ()), future))
+                    finished = False
+                elif not future.done():
+                    future.set_result(result)
+            finally:
+                if finished:
+                    self.admission.release()
+                self.queue.task_done()
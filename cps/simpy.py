@@ -1,9 +1,96 @@
 import ast
-from typing import Any
+import contextvars
+import inspect
+from typing import Any, Callable, NamedTuple, Optional, Union
+
+
+class TailCall(NamedTuple):
+    """
+    A call in tail position that has been handed back to the driver loop instead of being made.
+    """
+    func: Callable
+    args: tuple
+
+
+# set while a trampoline driver is running in the current context, so that continuations
+# invoked from inside a builtin bounce back to it instead of nesting a new driver
+_driving = contextvars.ContextVar("driving", default=False)
+
+
+class Scope:
+    """
+    One frame of bindings, chained to the frame it was created in.
+
+    Making a new frame is O(1): nothing is copied, and lookups walk outward until they find the name.
+    """
+    __slots__ = ("bindings", "parent")
+
+    def __init__(self, bindings: dict[str, Any], parent: Optional["Scope"] = None):
+        self.bindings = bindings
+        self.parent = parent
+
+    def __getitem__(self, name: str) -> Any:
+        scope = self
+        while scope is not None:
+            if name in scope.bindings:
+                return scope.bindings[name]
+            scope = scope.parent
+        raise KeyError(name)
+
+    def __setitem__(self, name: str, value: Any):
+        # writes only ever go to this frame, shadowing whatever the frames behind it say
+        self.bindings[name] = value
+
+    def __contains__(self, name: str) -> bool:
+        scope = self
+        while scope is not None:
+            if name in scope.bindings:
+                return True
+            scope = scope.parent
+        return False
+
+    def capture(self, names: frozenset[str]) -> "Scope":
+        """
+        Make a closure environment holding only these names, in front of the outermost (builtins) frame.
+
+        A closure that kept the whole chain would pin every value ever bound around it, and in a CPS chain it would
+        hang off the frame of the call before it, so lookups would get slower the longer the chain ran.
+        """
+        bindings = {}
+        missing = set(names)
+        scope = self
+        while scope.parent is not None:
+            if missing:
+                found = missing.intersection(scope.bindings)
+                for name in found:
+                    bindings[name] = scope.bindings[name]
+                missing -= found
+            scope = scope.parent
+        # whatever is still missing is a builtin, or unbound and will fail on lookup as it should
+        return Scope(bindings, scope)
+
+    def flatten(self) -> dict[str, Any]:
+        """
+        :return: every binding in front of the outermost (builtins) frame, with inner frames shadowing outer ones
+        """
+        frames = []
+        scope = self
+        while scope.parent is not None:
+            frames.append(scope.bindings)
+            scope = scope.parent
+        bindings = {}
+        for frame in reversed(frames):
+            bindings.update(frame)
+        return bindings
 
 
 class SimPy:
-    BUILTINS = {"complete": lambda: None}
+    BUILTINS = {"complete": lambda *_: None}
+
+    @classmethod
+    def scope(cls, env: Union[dict[str, Any], Scope]) -> Scope:
+        # plain dicts from callers become the outermost frame, with the builtins behind them
+        return env if isinstance(env, Scope) else Scope(env, Scope(cls.BUILTINS))
 
     @staticmethod
     def parse(code: str) -> ast.AST:
@@ -13,28 +100,36 @@ class SimPy:
         return CpsTransformer().visit(normal)
 
     @classmethod
-    def eval(cls, node: ast.AST, env: dict[str, Any]) -> Any:
+    def eval(cls, node: ast.AST, env: Union[dict[str, Any], Scope], trampoline: bool = False) -> Any:
         # the right way to do this is with a recursive function
         # that unfortunately necessitates some rather gross type inspection
+        if not isinstance(env, Scope):
+            env = cls.scope(env)
+
         if isinstance(node, ast.Module):
             assert len(node.body) == 1
-            return cls.eval(node.body[0], env)
+            return cls.eval(node.body[0], env, trampoline)
 
         elif isinstance(node, ast.Expr):
             # assert isinstance(node.value, ast.Call)
-            return cls.eval(node.value, env)
+            return cls.eval(node.value, env, trampoline)
 
         elif isinstance(node, ast.Name):
-            return (env | cls.BUILTINS)[node.id]
+            return env[node.id]
 
         elif isinstance(node, ast.Lambda):
             # so the problem here is that we need to both be able to actually call this, and be able to turn it
             # back into an ast node
-            return Lambda(node.args, node.body, env)
+            return Lambda(node.args, node.body, env.capture(free_variables(node)), trampoline)
 
         elif isinstance(node, ast.Call):
             # handle the lambda expression by preparing an invocation to eval
             # with the right environment
+            if trampoline:
+                # the function and its arguments are not in tail position, so they get driven to a value here;
+                # the call itself is in tail position and goes back to the driver
+                func = cls.drive(cls.eval(node.func, env, trampoline))
+                return TailCall(func, tuple(cls.drive(cls.eval(arg, env, trampoline)) for arg in node.args))
             return cls.eval(node.func, env)(*[cls.eval(arg, env) for arg in node.args])
 
         elif isinstance(node, ast.Constant):
@@ -43,16 +138,155 @@ class SimPy:
         else:
             raise NotImplementedError(type(node))
 
+    @classmethod
+    def run(cls, node: ast.AST, env: Union[dict[str, Any], Scope], fuel: Optional[int] = None) -> Any:
+        """
+        Evaluate in trampolined mode, so the Python stack stays flat no matter how long the chain of continuations.
+
+        Builtins called this way must return the result of calling their continuation (``return cont(x)``)
+        rather than discarding it, because that result is the next bounce for the driver.
+
+        :param fuel: if given, the number of bounces to make before giving up the worker; see drive
+        """
+        return cls.drive(cls.eval(node, env, trampoline=True), fuel)
+
+    @classmethod
+    def resume(cls, continuation: "Lambda", *args: Any, fuel: Optional[int] = None) -> Any:
+        """
+        Resume a suspended (or preempted) continuation, with a fuel budget like run.
+        """
+        return cls.drive(TailCall(continuation, args), fuel)
+
+    @staticmethod
+    def drive(result: Any, fuel: Optional[int] = None) -> Any:
+        """
+        Keep making tail calls until something other than a tail call comes back.
+
+        With a fuel budget, each bounce uses up one unit. If the budget runs out first, the pending call is handed
+        back as a Preempted continuation, which picks up where this left off when called.
+        """
+        if not isinstance(result, TailCall):
+            return result
+        token = _driving.set(True)
+        try:
+            while isinstance(result, TailCall):
+                if fuel is not None:
+                    if fuel <= 0:
+                        return Preempted.pending(result)
+                    fuel -= 1
+                result = result.func(*result.args)
+        finally:
+            _driving.reset(token)
+        return result
+
+    @staticmethod
+    async def drive_async(result: Any, fuel: Optional[int] = None) -> Any:
+        """
+        Like drive, except that a builtin may also return an awaitable, which is awaited for its next bounce.
+
+        An async builtin looks like ``async def fetch(url, cont): return cont(await get(url))``. Awaiting does not
+        use fuel.
+        """
+        token = _driving.set(True)
+        try:
+            while True:
+                if isinstance(result, TailCall):
+                    if fuel is not None:
+                        if fuel <= 0:
+                            return Preempted.pending(result)
+                        fuel -= 1
+                    result = result.func(*result.args)
+                elif inspect.isawaitable(result):
+                    result = await result
+                else:
+                    return result
+        finally:
+            _driving.reset(token)
+
+
+def free_variables(node: ast.Lambda) -> frozenset[str]:
+    """
+    The names a lambda reads from its enclosing scopes. Worked out once per node and kept on it.
+    """
+    if hasattr(node, "free_variables"):
+        return node.free_variables
+
+    # find every lambda inside this one that doesn't know its free variables yet, outermost first; this has to be
+    # iterative, since a CPS chain nests a lambda for every statement
+    found = []
+    stack = [node]
+    while stack:
+        lam = stack.pop()
+        names, nested = set(), []
+        body = [lam.body]
+        while body:
+            child = body.pop()
+            if isinstance(child, ast.Lambda):
+                nested.append(child)
+                if not hasattr(child, "free_variables"):
+                    stack.append(child)
+            else:
+                if isinstance(child, ast.Name):
+                    names.add(child.id)
+                body.extend(ast.iter_child_nodes(child))
+        found.append((lam, names, nested))
+
+    # then fill them in innermost first, so each one can use what its nested lambdas need
+    for lam, names, nested in reversed(found):
+        for child in nested:
+            names |= child.free_variables
+        lam.free_variables = frozenset(names - {arg.arg for arg in lam.args.args})
+    return node.free_variables
+
 
 class Lambda(ast.Lambda):
-    def __init__(self, args, body, environment: dict[str, Any]):
+    def __init__(self, args, body, environment: Union[dict[str, Any], Scope], trampoline: bool = False):
         super().__init__(args, body)
-        self.environment = environment
+        self.environment = SimPy.scope(environment)
+        self.trampoline = trampoline
 
     def __call__(self, *args, **kwargs):
-        # step 1: need to match up my args and their names
-        new_environment = {arg.arg: value for arg, value in zip(self.args.args, args)}
-        return SimPy.eval(self.body, new_environment | self.environment)
+        # step 1: need to match up my args and their names, in a new frame in front of the closure
+        new_environment = Scope({arg.arg: value for arg, value in zip(self.args.args, args)}, self.environment)
+        if not self.trampoline:
+            return SimPy.eval(self.body, new_environment)
+
+        # inside a driver we just hand back the next bounce; called from outside (e.g. resuming a suspended
+        # continuation) we have to start a driver of our own
+        result = SimPy.eval(self.body, new_environment, trampoline=True)
+        return result if _driving.get() else SimPy.drive(result)
+
+    def __reduce__(self):
+        # the builtins frame holds functions that can't be pickled, and belongs to whoever loads this anyway
+        return type(self), (self.args, self.body, self.environment.flatten(), self.trampoline)
+
+    def fork(self) -> "Lambda":
+        """
+        Make an independent copy of this continuation in O(1).
+
+        The fork gets an empty frame of its own in front of the shared environment, so bindings are copied on write:
+        setting ``fork.environment[name]`` changes that branch only, and a branch costs memory only for what it
+        changes. The values themselves are shared, so a branch that mutates a list in place is seen by all of them.
+        """
+        return Lambda(self.args, self.body, Scope({}, self.environment), self.trampoline)
+
+
+class Preempted(Lambda):
+    """
+    A continuation for an execution that ran out of fuel rather than suspending on its own.
+
+    It is an ordinary Lambda whose body makes the call that was about to happen, so it can be resumed, forked or
+    persisted like any other continuation; calling it (with any arguments, which are ignored) carries on.
+    """
+    @classmethod
+    def pending(cls, call: TailCall) -> "Preempted":
+        names = [f"__arg{i}" for i in range(len(call.args))]
+        body = ast.Call(func=ast.Name(id="__func", ctx=ast.Load()),
+                        args=[ast.Name(id=name, ctx=ast.Load()) for name in names],
+                        keywords=[])
+        args = ast.arguments(posonlyargs=[], args=[], vararg=None, kwonlyargs=[], kw_defaults=[], kwarg=None,
+                             defaults=[])
+        return cls(args, body, {"__func": call.func, **dict(zip(names, call.args))}, trampoline=True)
 
 
 class CpsTransformer(ast.NodeTransformer):
@@ -64,12 +298,11 @@ class CpsTransformer(ast.NodeTransformer):
         return ast.Module(body=self.cps_convert(body), type_ignores=node.type_ignores)
 
     def cps_convert(self, body: list[ast.Expr]):
-        if len(body) == 1:
-            return body
-        else:
-            # take the last two items from the body and convert them
-            new_last = self.cps_convert_two(body[-2], body[-1])
-            return self.cps_convert(body[:-2] + [new_last])
+        # work back from the end: each statement takes everything after it, already converted, as its continuation
+        last = body[-1]
+        for statement in reversed(body[:-1]):
+            last = self.cps_convert_two(statement, last)
+        return [last]
 
     def cps_convert_two(self, penultimate: ast.Expr, ultimate: ast.Expr) -> ast.Expr:
         # whatever comes next is definitely a lambda expression
@@ -91,3 +324,4 @@ class CpsTransformer(ast.NodeTransformer):
         return ast.arguments(
             posonlyargs=[], args=[ast.arg(arg="_")], vararg=None, kwonlyargs=[], kw_defaults=[], kwarg=None, defaults=[]
         )
+
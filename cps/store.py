@@ -0,0 +1,391 @@
+"""
+Keeping suspended executions somewhere while they wait for their next message.
+
+ExecutionStore is the interface; MemoryStore keeps everything in a dict, and SQLiteStore keeps it in a local SQLite
+database. Executions are saved in their persisted form (see CapabilityExecutionState.persist) under a string id.
+
+An execution whose environment is a TrackedEnvironment only needs the bindings that changed since it was last saved,
+so SQLiteStore writes those as a delta, and every so often a whole snapshot again.
+
+Executions of the same capability suspend with the same continuations, so SQLiteStore keeps each distinct
+continuation once, in a table keyed by its hash, and the saved states only refer to it.
+"""
+import abc
+import hashlib
+import pickle
+import sqlite3
+import time
+import weakref
+from typing import Any, Iterable, NamedTuple, Optional
+
+from cps import codec
+from cps.cache import LRUCache
+from cps.cps import CapabilityExecutionState, continuation_hash
+
+
+# values of these types can only change by rebinding the name, which TrackedEnvironment sees
+IMMUTABLE = frozenset({int, float, complex, bool, str, bytes, type(None)})
+
+
+class Changes(NamedTuple):
+    changed: dict[str, Any]
+    deleted: tuple[str, ...]
+    # a digest of each binding as it is now, to compare against at the next checkpoint
+    digests: dict[str, Optional[bytes]]
+    # the changed values that were pickled to find their digests, so a delta needn't pickle them again
+    pickled: dict[str, bytes]
+
+
+class TrackedEnvironment(dict):
+    """
+    An environment that knows which bindings changed since its last checkpoint.
+
+    Binding and deleting names is seen as it happens. A value changed in place (a list appended to, say) can't be
+    seen that way, so at each checkpoint every value that isn't of an immutable type is pickled and hashed, and
+    compared with its digest from the last one. So a delta saves bytes written, not CPU: every save still pickles all
+    of those values, changed or not, and hashing them on top makes a delta save somewhat slower than a snapshot (in
+    benchmarks/store.py, around 11k saves/s against 14k). A value that pickles differently each time is simply
+    always written.
+
+    The checkpoint belongs to whichever execution saved the environment last; generation counts checkpoints, so a
+    store can tell when another execution (or another store) has checkpointed it since.
+
+    It pickles as a fresh TrackedEnvironment, with nothing marked as changed.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.changed = set()
+        self.deleted = set()
+        self.digests: dict[str, Optional[bytes]] = {}
+        self.generation = 0
+
+    def __reduce__(self):
+        return TrackedEnvironment, (dict(self),)
+
+    def __setitem__(self, name: str, value: Any):
+        super().__setitem__(name, value)
+        self.changed.add(name)
+        self.deleted.discard(name)
+
+    def __delitem__(self, name: str):
+        super().__delitem__(name)
+        self.changed.discard(name)
+        self.deleted.add(name)
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def update(self, *args, **kwargs):
+        for name, value in dict(*args, **kwargs).items():
+            self[name] = value
+
+    def setdefault(self, name: str, default: Any = None) -> Any:
+        if name not in self:
+            self[name] = default
+        return self[name]
+
+    def pop(self, name: str, *default: Any) -> Any:
+        if name in self:
+            value = self[name]
+            del self[name]
+            return value
+        return super().pop(name, *default)
+
+    def popitem(self) -> tuple[str, Any]:
+        name, value = super().popitem()
+        self.changed.discard(name)
+        self.deleted.add(name)
+        return name, value
+
+    def clear(self):
+        self.deleted.update(self)
+        self.changed.clear()
+        super().clear()
+
+    def changes(self) -> Changes:
+        """
+        :return: the bindings changed and the names deleted since the last checkpoint
+        """
+        changed = {}
+        digests = {}
+        pickled = {}
+        for name, value in self.items():
+            if type(value) in IMMUTABLE:
+                data = digest = None
+            else:
+                data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+                digest = hashlib.sha256(data).digest()
+            digests[name] = digest
+            if name in self.changed or name not in self.digests or self.digests[name] != digest:
+                changed[name] = value
+                if data is not None:
+                    pickled[name] = data
+        return Changes(changed, tuple(self.deleted), digests, pickled)
+
+    def checkpoint(self, changes: Changes):
+        """
+        Start a new checkpoint, once the changes from changes() are safely written.
+        """
+        self.digests = changes.digests
+        self.changed.clear()
+        self.deleted.clear()
+        self.generation += 1
+
+
+class ExecutionStore(abc.ABC):
+    def __enter__(self) -> "ExecutionStore":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @abc.abstractmethod
+    def save(self, execution_id: str, state: CapabilityExecutionState):
+        pass
+
+    @abc.abstractmethod
+    def load(self, execution_id: str) -> Optional[CapabilityExecutionState]:
+        """
+        :return: the execution saved under this id, or None if there isn't one
+        """
+        pass
+
+    @abc.abstractmethod
+    def delete(self, execution_id: str):
+        pass
+
+    @abc.abstractmethod
+    def waiting_on(self, pattern: str) -> dict[str, CapabilityExecutionState]:
+        """
+        :return: every execution whose message pattern is exactly this one, by id
+        """
+        pass
+
+    def save_many(self, states: Iterable[tuple[str, CapabilityExecutionState]]):
+        for execution_id, state in states:
+            self.save(execution_id, state)
+
+    def flush(self):
+        """
+        Make sure everything saved so far has been written.
+        """
+
+    def close(self):
+        self.flush()
+
+
+class MemoryStore(ExecutionStore):
+    """
+    A store that keeps persisted executions in memory, for tests and for running without a database.
+    """
+    def __init__(self):
+        self.rows: dict[str, tuple[Optional[str], bytes]] = {}
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def save(self, execution_id: str, state: CapabilityExecutionState):
+        self.rows[execution_id] = (state.message_pattern, state.persist())
+
+    def load(self, execution_id: str) -> Optional[CapabilityExecutionState]:
+        row = self.rows.get(execution_id)
+        return CapabilityExecutionState.load(row[1]) if row else None
+
+    def delete(self, execution_id: str):
+        self.rows.pop(execution_id, None)
+
+    def waiting_on(self, pattern: str) -> dict[str, CapabilityExecutionState]:
+        return {execution_id: CapabilityExecutionState.load(data)
+                for execution_id, (message_pattern, data) in self.rows.items() if message_pattern == pattern}
+
+
+class SQLiteStore(ExecutionStore):
+    """
+    A store in a local SQLite database, in WAL mode.
+
+    Saves and deletes are buffered and written together, in one transaction, so the cost of a commit is shared by
+    the whole batch. The batch is written by the save or delete that brings it to batch_size, or by the first one
+    after the oldest buffered write has waited max_delay seconds; there is no timer, so a store that stops being
+    written to keeps its buffer until it is flushed or closed, or a read needs it. Reads see buffered writes.
+    Anything still buffered when the process dies is lost; call flush where that matters.
+
+    Saving the same TrackedEnvironment under the same id again writes a delta instead of a snapshot, until there
+    are compact_every deltas; the next save is a whole snapshot, and the deltas are dropped. Loading an execution
+    replays its deltas over its snapshot, and gives back a TrackedEnvironment that carries on the chain.
+
+    With dedup, continuations are stored by hash in a table of their own, and states loaded with the same
+    continuation share one copy of its source. Continuations are never removed from that table; there is one per
+    suspension point of each capability, not one per execution.
+    """
+    def __init__(self, path: str, batch_size: int = 1000, max_delay: float = 0.05, compact_every: int = 16,
+                 dedup: bool = True):
+        if batch_size < 1:
+            raise ValueError(f"batch size must be positive, not {batch_size}")
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.compact_every = compact_every
+        self.dedup = dedup
+        # continuations known to be in the table (or on their way), and the sources of ones loaded recently
+        self.stored_continuations: set[str] = set()
+        self.pending_continuations: dict[str, str] = {}
+        self.sources = LRUCache(maxsize=4096)
+        # by id: the message pattern, a new snapshot (if there is one) and the deltas after it; None for a delete
+        self.pending: dict[str, Optional[tuple[Optional[str], Optional[bytes], list[tuple[int, bytes]]]]] = {}
+        self.writes = 0
+        self.oldest = None
+        # state bytes handed to SQLite so far, snapshots and deltas together
+        self.bytes_written = 0
+        # by id: the environment that was last saved or loaded, how many deltas follow its snapshot, and the
+        # environment's generation after that save or load
+        self.chains: dict[str, tuple[weakref.ref, int, int]] = {}
+        self.connection = sqlite3.connect(path, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # in WAL mode, NORMAL only syncs at checkpoints; a crash can lose the last commits but not corrupt the file
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS executions ("
+                                "id TEXT PRIMARY KEY, message_pattern TEXT, state BLOB NOT NULL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS executions_message_pattern "
+                                "ON executions (message_pattern)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS deltas ("
+                                "id TEXT, seq INTEGER, state BLOB NOT NULL, PRIMARY KEY (id, seq)) WITHOUT ROWID")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS continuations ("
+                                "hash TEXT PRIMARY KEY, source TEXT NOT NULL)")
+
+    def __len__(self) -> int:
+        self.flush()
+        return self.connection.execute("SELECT COUNT(*) FROM executions").fetchone()[0]
+
+    def save(self, execution_id: str, state: CapabilityExecutionState):
+        environment = state.environment
+        if self.dedup:
+            digest = continuation_hash(state.continuation)
+            if digest not in self.stored_continuations:
+                self.stored_continuations.add(digest)
+                self.pending_continuations[digest] = state.continuation
+        chain = self.chains.get(execution_id)
+        entry = self.pending.get(execution_id)
+        tracked = isinstance(environment, TrackedEnvironment)
+        changes = environment.changes() if tracked else None
+        # the environment only forgets what changed once the state that records it has been encoded; and if it has
+        # been checkpointed by anyone else since (another id, say), the changes since our save are lost to us
+        if chain and chain[0]() is environment and chain[2] == environment.generation and \
+                chain[1] < self.compact_every:
+            seq = chain[1] + 1
+            delta = codec.encode_delta({name: value for name, value in changes.changed.items()
+                                        if name not in changes.pickled},
+                                       changes.deleted, state.continuation, state.message_pattern, self.dedup,
+                                       changes.pickled)
+            snapshot, deltas = (entry[1], entry[2]) if entry else (None, [])
+            self.pending[execution_id] = (state.message_pattern, snapshot, deltas + [(seq, delta)])
+        else:
+            seq = 0
+            snapshot = codec.encode_state(dict(environment), state.continuation, state.message_pattern, self.dedup)
+            self.pending[execution_id] = (state.message_pattern, snapshot, [])
+        if tracked:
+            environment.checkpoint(changes)
+        self.remember(execution_id, environment, seq)
+        self.wrote()
+
+    def delete(self, execution_id: str):
+        self.chains.pop(execution_id, None)
+        self.pending[execution_id] = None
+        self.wrote()
+
+    def remember(self, execution_id: str, environment: dict[str, Any], seq: int):
+        if isinstance(environment, TrackedEnvironment):
+            self.chains[execution_id] = (weakref.ref(environment), seq, environment.generation)
+        else:
+            self.chains.pop(execution_id, None)
+
+    def wrote(self):
+        self.writes += 1
+        if self.oldest is None:
+            self.oldest = time.monotonic()
+        if self.writes >= self.batch_size or time.monotonic() - self.oldest >= self.max_delay:
+            self.flush()
+
+    def load(self, execution_id: str) -> Optional[CapabilityExecutionState]:
+        if execution_id in self.pending:
+            self.flush()
+        rows = self.connection.execute("SELECT e.state, d.state FROM executions e LEFT JOIN deltas d ON d.id = e.id "
+                                       "WHERE e.id = ? ORDER BY d.seq", (execution_id,)).fetchall()
+        if not rows:
+            return None
+        return self.rebuild(execution_id, rows[0][0], [delta for _, delta in rows if delta is not None])
+
+    def waiting_on(self, pattern: str) -> dict[str, CapabilityExecutionState]:
+        self.flush()
+        rows = self.connection.execute("SELECT e.id, e.state, d.state FROM executions e "
+                                       "LEFT JOIN deltas d ON d.id = e.id "
+                                       "WHERE e.message_pattern = ? ORDER BY e.id, d.seq", (pattern,))
+        chains = {}
+        for execution_id, snapshot, delta in rows:
+            deltas = chains.setdefault(execution_id, (snapshot, []))[1]
+            if delta is not None:
+                deltas.append(delta)
+        return {execution_id: self.rebuild(execution_id, snapshot, deltas)
+                for execution_id, (snapshot, deltas) in chains.items()}
+
+    def rebuild(self, execution_id: str, snapshot: bytes, deltas: list[bytes]) -> CapabilityExecutionState:
+        environment, continuation, message_pattern = codec.decode_state(snapshot, self.continuation)
+        for delta in deltas:
+            changed, deleted, continuation, message_pattern = codec.decode_delta(delta, self.continuation)
+            environment.update(changed)
+            for name in deleted:
+                environment.pop(name, None)
+        environment = TrackedEnvironment(environment)
+        environment.checkpoint(environment.changes())
+        self.remember(execution_id, environment, len(deltas))
+        return CapabilityExecutionState(environment, continuation, message_pattern)
+
+    def continuation(self, digest: str) -> str:
+        """
+        :return: the source of the continuation with this hash
+        """
+        def fetch():
+            if digest in self.pending_continuations:
+                return self.pending_continuations[digest]
+            row = self.connection.execute("SELECT source FROM continuations WHERE hash = ?", (digest,)).fetchone()
+            if row is None:
+                raise ValueError(f"no continuation with hash {digest}")
+            return row[0]
+        return self.sources.get(digest, fetch)
+
+    def flush(self):
+        if not self.pending:
+            return
+        snapshots, patterns, deltas, deletes = [], [], [], []
+        for execution_id, entry in self.pending.items():
+            if entry is None:
+                deletes.append((execution_id,))
+                continue
+            message_pattern, snapshot, steps = entry
+            if snapshot is None:
+                patterns.append((message_pattern, execution_id))
+            else:
+                snapshots.append((execution_id, message_pattern, snapshot))
+            deltas.extend((execution_id, seq, delta) for seq, delta in steps)
+        continuations = list(self.pending_continuations.items())
+        self.bytes_written += sum(len(row[-1]) for row in snapshots) + sum(len(row[-1]) for row in deltas) + \
+            sum(len(source.encode()) for _, source in continuations)
+        with self.connection:
+            self.connection.execute("BEGIN")
+            self.connection.executemany("INSERT OR IGNORE INTO continuations (hash, source) VALUES (?, ?)",
+                                        continuations)
+            # a new snapshot (or a delete) makes the deltas before it obsolete
+            self.connection.executemany("DELETE FROM deltas WHERE id = ?",
+                                        deletes + [(execution_id,) for execution_id, _, _ in snapshots])
+            self.connection.executemany("DELETE FROM executions WHERE id = ?", deletes)
+            self.connection.executemany("INSERT OR REPLACE INTO executions (id, message_pattern, state) "
+                                        "VALUES (?, ?, ?)", snapshots)
+            self.connection.executemany("UPDATE executions SET message_pattern = ? WHERE id = ?", patterns)
+            self.connection.executemany("INSERT OR REPLACE INTO deltas (id, seq, state) VALUES (?, ?, ?)", deltas)
+        self.pending.clear()
+        self.pending_continuations.clear()
+        self.writes = 0
+        self.oldest = None
+
+    def close(self):
+        self.flush()
+        self.connection.close()
@@ -8,9 +8,14 @@ setup(
     author="Daniel K Lyons",
     author_email="dlyons@nrao.edu",
     license="GPL3",
+    # asyncio.Task.cancelling, in the runtime's workers, is new in 3.11
+    python_requires=">=3.11",
     install_requires=[
         "asteval",
     ],
+    extras_require={
+        "numpy": ["numpy"],
+    },
     tests_require=['pytest'],
     packages=find_packages('cps'),
 )
\ No newline at end of file
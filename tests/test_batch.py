@@ -0,0 +1,55 @@
+import os
+
+from cps.batch import BatchResumer, resume_batch
+from cps.cps import CapabilityExecutionState
+
+
+def double(m):
+    return m * 2
+
+
+def die(m):
+    os._exit(1)
+
+
+def fail(m):
+    raise RuntimeError(f"failed on {m}")
+
+
+def test_order():
+    batch = [(CapabilityExecutionState({'handle': double, 'k': i}, f'lambda msg: handle(msg) + {i % 3}', None), i)
+             for i in range(50)]
+    results = resume_batch(batch, workers=3)
+    assert [r.value for r in results] == [i * 2 + i % 3 for i in range(50)]
+    assert all(r.ok for r in results)
+
+
+def test_failure_isolated():
+    good = CapabilityExecutionState({'handle': double}, 'lambda msg: handle(msg)', None)
+    unpicklable = CapabilityExecutionState({'handle': lambda m: m}, 'lambda msg: handle(msg)', None)
+    failing = CapabilityExecutionState({'handle': fail}, 'lambda msg: handle(msg)', None)
+    results = resume_batch([(good, 1), (unpicklable, 2), (good, 3), (failing, 4)], workers=2)
+    assert results[0].value == 2
+    assert not results[1].ok
+    assert results[2].value == 6
+    # an error inside the continuation is that execution's failure, not a result of None
+    assert isinstance(results[3].error, RuntimeError) and str(results[3].error) == 'failed on 4'
+
+
+def test_worker_death():
+    good = CapabilityExecutionState({'handle': double}, 'lambda msg: handle(msg)', None)
+    dying = CapabilityExecutionState({'handle': die}, 'lambda m: handle(m)', None)
+    with BatchResumer(workers=1) as resumer:
+        assert not resumer.resume([(dying, 1)])[0].ok
+        # the shard gets a new process and carries on
+        assert [r.value for r in resumer.resume([(good, 1), (good, 2)])] == [2, 4]
+
+
+def test_worker_death_isolated():
+    good = CapabilityExecutionState({'handle': double}, 'lambda msg: handle(msg)', None)
+    dying = CapabilityExecutionState({'handle': die}, 'lambda m: handle(m)', None)
+    with BatchResumer(workers=1, chunk_size=2) as resumer:
+        # the dying entry takes its chunk and the chunk queued behind it down, but only it should fail
+        results = resumer.resume([(good, 1), (dying, 2), (good, 3), (good, 4), (dying, 5), (good, 6)])
+        assert [r.value if r.ok else None for r in results] == [2, None, 6, 8, None, 12]
+        assert [r.value for r in resumer.resume([(good, 1)])] == [2]
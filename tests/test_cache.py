@@ -0,0 +1,26 @@
+import pytest
+
+from cps.cache import LRUCache
+
+
+def test_hits_and_misses():
+    cache = LRUCache(maxsize=2)
+    assert cache.get('a', lambda: 1) == 1
+    assert cache.get('a', lambda: 2) == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_eviction():
+    cache = LRUCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a', lambda: None)
+    cache.put('c', 3)
+    # b was the least recently used
+    assert 'a' in cache and 'c' in cache and 'b' not in cache
+    assert len(cache) == 2
+
+
+def test_size_limit():
+    with pytest.raises(ValueError):
+        LRUCache(maxsize=0)
@@ -1,3 +1,8 @@
+import asyncio
+import time
+
+import pytest
+
 from cps.caplisp import *
 
 
@@ -16,7 +21,7 @@ def test_binop():
 def test_list():
     l = Caplisp.parse_python('[1,2]')
     assert l.eval({}) == [1, 2]
-    assert l.unparse() == '(1 2)'
+    assert l.unparse() == '[1 2]'
 
 def test_func():
     f = Caplisp.parse_python('f()')
@@ -31,3 +36,224 @@ def test_nesting():
     f = Caplisp.parse_python('f(x) * g(y) + 3')
     assert f.unparse() == '(+ (* (f x) (g y)) 3)'
     assert f.eval({'f': lambda x: x+3, 'g': lambda x: x*2, 'x': 1, 'y': 4}) == 35
+
+def test_compile():
+    environment = {'f': lambda x: x+3, 'g': lambda x: x*2, 'h': lambda *xs: sum(xs), 'x': 1, 'y': 4}
+    for source in ['23', '"foo"', 'x', 'x*y', '[1,2]', '[x, f(y)]', 'g(x)',
+                   'f(x) * g(y) + 3', 'h()', 'h(x, y, 3)', '(x + y) - (x * y) // 2']:
+        expr = Caplisp.parse_python(source)
+        assert expr.compile()(environment) == expr.eval(environment)
+
+def test_compile_reuse():
+    expr = Caplisp.parse_python('f(x) * g(y) + 3').compile()
+    assert expr({'f': lambda x: x+3, 'g': lambda x: x*2, 'x': 1, 'y': 4}) == 35
+    assert expr({'f': lambda x: x, 'g': lambda x: x, 'x': 2, 'y': 5}) == 13
+
+def test_resolve():
+    expr = Caplisp.resolve(Caplisp.parse_python('f(x) * g(y) + x'))
+    assert expr.names == ('f', 'x', 'g', 'y')
+    assert expr((lambda x: x+3, 1, lambda x: x*2, 4)) == 33
+
+    environment = {'f': lambda x: x+3, 'g': lambda x: x*2, 'x': 1, 'y': 4, 'unused': 0}
+    assert expr.bind(environment) == (environment['f'], 1, environment['g'], 4)
+    assert expr.eval(environment) == Caplisp.parse_python('f(x) * g(y) + x').eval(environment)
+
+    assert Caplisp.resolve(Caplisp.parse_python('x')).eval({'x': 23}) == 23
+    assert Caplisp.resolve(Caplisp.parse_python('23')).eval({}) == 23
+
+def test_read():
+    environment = {'f': lambda x: x+3, 'g': lambda x: x*2, 'x': 1, 'y': 4}
+    for source in ['23', '"foo"', 'x', 'x*y', '[1,2]', '[]', 'f(x) * g(y) + 3', 'f(x, "a b", 1.5, None)', '2 ** x // 3']:
+        expr = Caplisp.parse_python(source)
+        read = Caplisp.parse_caplisp(expr.unparse())
+        assert read.unparse() == expr.unparse()
+        if 'f(x,' not in source:
+            assert read.eval(environment) == expr.eval(environment)
+
+    # lists whose first element could be a function, and constants that don't look like numbers
+    for source in ['[x, 1]', '[f(x), 1]', '[[x], f]', '2j', '1e400 * x', '...', '[b"x", 0.1, 1e16]']:
+        expr = Caplisp.parse_python(source)
+        read = Caplisp.parse_caplisp(expr.unparse())
+        assert read.unparse() == expr.unparse()
+        assert repr(read.eval(environment)) == repr(expr.eval(environment)), source
+    for value in [float('nan'), float('-inf'), 1 - 2j, complex(float('inf'), -1), -0j, -0.0]:
+        assert repr(Caplisp.parse_caplisp(CaplispConstant(value).unparse()).eval({})) == repr(value)
+
+def test_read_many(tmp_path):
+    programs = ['(+ (* (f x) (g y)) 3)', '[1 2]', '(f "it\'s" \'a\\\'b\')', 'x']
+    assert [e.unparse() for e in Caplisp.read_caplisp(memoryview('\n'.join(programs).encode()))] == \
+        ['(+ (* (f x) (g y)) 3)', '[1 2]', '(f "it\'s" "a\'b")', 'x']
+
+    path = tmp_path / 'programs.caplisp'
+    path.write_text('\n'.join(programs))
+    assert len(list(Caplisp.load_caplisp(str(path)))) == 4
+
+    path.write_text('')
+    assert list(Caplisp.load_caplisp(str(path))) == []
+
+def test_read_legacy(tmp_path):
+    # written by unparse before lists had brackets
+    programs = ['(+ (* (f x) (g y)) 3)', '(1 2)', '((f x) 2)', '(x (1 2))', '()']
+    read = list(Caplisp.read_caplisp('\n'.join(programs), legacy=True))
+    assert [e.unparse() for e in read] == ['(+ (* (f x) (g y)) 3)', '[1 2]', '((f x) 2)', '(x [1 2])', '[]']
+    assert read[1].eval({}) == [1, 2]
+    assert Caplisp.parse_caplisp('(1 2)', legacy=True).eval({}) == [1, 2]
+    path = tmp_path / 'programs.caplisp'
+    path.write_text('\n'.join(programs))
+    assert [e.unparse() for e in Caplisp.load_caplisp(str(path), legacy=True)] == [e.unparse() for e in read]
+    # without legacy, a parenthesized form is always a call
+    assert isinstance(Caplisp.parse_caplisp('(1 2)'), CaplispFuncall)
+
+
+def test_read_errors():
+    for bad in ['(f x', 'f x)', '(f x) (', '', '(f x]', '[x)', '()', '[1', '1x', '+x']:
+        with pytest.raises(ValueError):
+            Caplisp.parse_caplisp(bad)
+
+def test_intern():
+    interner = CaplispInterner()
+    first = Caplisp.parse_python('f(x) * g(y) + 3', interner)
+    second = Caplisp.parse_python('h(f(x) * g(y)) + 3', interner)
+    assert second.args[0].args[0] is first.args[0]
+    assert first.args[1] is second.args[1]
+    assert second.eval({'f': lambda x: x+3, 'g': lambda x: x*2, 'h': lambda x: -x, 'x': 1, 'y': 4}) == -29
+
+    # equal but different constants stay apart
+    assert Caplisp.parse_python('1', interner) is not Caplisp.parse_python('1.0', interner)
+    assert Caplisp.parse_python('1', interner) is not Caplisp.parse_python('True', interner)
+
+    read = list(Caplisp.read_caplisp('(* (f x) (g y)) (h (* (f x) (g y)))', interner))
+    assert read[0] is first.args[0]
+    assert read[1].args[0] is read[0]
+
+def test_slots():
+    with pytest.raises(AttributeError):
+        Caplisp.parse_python('x').other = 1
+
+
+@pytest.mark.parametrize('use_numpy', [False, True])
+def test_eval_batch(use_numpy):
+    if use_numpy:
+        pytest.importorskip('numpy')
+    tree = Caplisp.parse_python("(x * 3 + y) % 7 - f(x) / 2")
+    rows = [{'x': x, 'y': x * x - 5, 'f': abs} for x in range(-20, 20)]
+    columns = {'x': [row['x'] for row in rows], 'y': [row['y'] for row in rows], 'f': abs}
+    result = Caplisp.eval_batch(tree, columns, use_numpy)
+    assert list(result) == [tree.eval(row) for row in rows]
+    if use_numpy:
+        import numpy
+        arrays = dict(columns, x=numpy.array(columns['x']), y=numpy.array(columns['y']))
+        assert Caplisp.eval_batch(tree, arrays, use_numpy).tolist() == list(result)
+    assert list(Caplisp.eval_batch(Caplisp.parse_python("2 ** 3"), columns, use_numpy)) == [8] * 40
+    assert [list(row) for row in Caplisp.eval_batch(CaplispList([CaplispVariable('x'), CaplispConstant(1)]),
+                                                    {'x': [1, 2]}, use_numpy)] == [[1, 1], [2, 1]]
+
+
+@pytest.mark.parametrize('use_numpy', [False, True])
+def test_eval_batch_errors(use_numpy):
+    if use_numpy:
+        pytest.importorskip('numpy')
+    assert list(Caplisp.eval_batch(Caplisp.parse_python("x ** (0 - 1)"), {'x': [1, 2, 4]}, use_numpy)) == [1, 0.5, 0.25]
+    with pytest.raises(ZeroDivisionError):
+        Caplisp.eval_batch(Caplisp.parse_python("1 / x"), {'x': [1, 0]}, use_numpy)
+    with pytest.raises(ValueError):
+        Caplisp.eval_batch(Caplisp.parse_python("x + y"), {'x': [1, 0], 'y': [1]}, use_numpy)
+
+
+def test_pure():
+    calls = []
+
+    @Caplisp.pure(maxsize=2)
+    def lookup(key):
+        calls.append(key)
+        return len(key)
+
+    assert lookup.__name__ == 'lookup'
+    expr = Caplisp.parse_python('lookup(x) * 2 + lookup(x)')
+    assert expr.eval({'lookup': lookup, 'x': 'abc'}) == 9
+    assert expr.compile()({'lookup': lookup, 'x': 'abc'}) == 9
+    assert calls == ['abc']
+    for key in ['a', 'b', 'abc']:
+        lookup(key)
+    assert calls == ['abc', 'a', 'b', 'abc']
+    assert lookup.cache.hits == 3 and len(lookup.cache) == 2
+    assert Caplisp.pure(len)([1, 2]) == 2
+    # equal arguments of different types are different calls
+    show = Caplisp.pure(repr)
+    assert [show(1), show(True), show(1.0), show(1)] == ['1', 'True', '1.0', '1']
+    assert show.cache.hits == 1 and show.cached([True]) and not show.cached([1 + 0j])
+
+
+def test_share():
+    counted = []
+
+    def count(x):
+        counted.append(x)
+        return x
+
+    square = CaplispFunctionReference(Caplisp.pure(lambda x: x * x, maxsize=1), 'square')
+    add = OPERATOR_REFERENCES['+']
+    inner = CaplispFuncall(square, CaplispFuncall(add, CaplispVariable('x'), CaplispConstant(1)))
+    tree = CaplispFuncall(add, inner, CaplispFuncall(OPERATOR_REFERENCES['*'], inner, CaplispFuncall(
+        CaplispVariable('count'), CaplispFuncall(add, CaplispVariable('x'), CaplispConstant(1)))))
+    environment = {'x': 2, 'count': count}
+
+    expr = Caplisp.resolve(tree)
+    assert len(expr.shared) == 2
+    assert expr.eval(environment) == tree.eval(environment) == 9 + 9 * 3
+    assert Caplisp.resolve(tree, share=False).shared == ()
+    # calls through variables might not be pure, so they are never shared
+    assert len(counted) == 2
+    assert len(Caplisp.resolve(Caplisp.parse_python('f(x) + f(x)')).shared) == 0
+
+
+def test_eval_concurrent():
+    running = []
+    peak = []
+
+    def slow(x):
+        running.append(x)
+        peak.append(len(running))
+        time.sleep(0.05)
+        running.remove(x)
+        return x + 1
+
+    async def slow_async(x):
+        await asyncio.sleep(0.05)
+        return x * 10
+
+    environment = {'f': slow, 'g': slow, 'h': slow_async, 'x': 1, 'y': 2}
+    expr = Caplisp.parse_python('f(x) * g(y) + h(x) + f(g(3))')
+    start = time.perf_counter()
+    assert Caplisp.eval_concurrent(expr, environment) == 2 * 3 + 10 + 5
+    # three rounds of calls (the nested one has to wait), not five calls in a row
+    assert time.perf_counter() - start < 0.2
+    assert max(peak) == 3
+
+    peak.clear()
+    assert Caplisp.eval_concurrent(expr, environment, max_concurrent=1) == 21
+    assert max(peak) == 1
+    assert Caplisp.eval_concurrent(Caplisp.parse_python('[f(x), 2 + y]'), environment) == [2, 4]
+
+
+@pytest.mark.parametrize('use_numpy', [False, True])
+def test_eval_batch_exact(use_numpy):
+    if use_numpy:
+        pytest.importorskip('numpy')
+    for source, columns in [('x + y', {'x': [True, True], 'y': [True, False]}),
+                            ('x * y', {'x': [2 ** 40, 3], 'y': [2 ** 40, 4]}),
+                            ('x ** y + 1', {'x': [3, 2], 'y': [50, 3]}),
+                            ('x - y', {'x': [-2 ** 62, 0], 'y': [2 ** 62, 1]}),
+                            ('x / y', {'x': [2 ** 60 + 1, 7], 'y': [3, 2]}),
+                            ('x * 2.5 + y', {'x': [1, 2], 'y': [0.5, 1.5]}),
+                            # mixed ints and floats are not all floats
+                            ('x - 10 ** 17', {'x': [10 ** 17 + 1, 0.5]}),
+                            ('x // 3', {'x': [7, 7.5]}),
+                            ('x + y', {'x': [1, 'a'], 'y': [2, 'b']})]:
+        tree = Caplisp.parse_python(source)
+        rows = [dict(zip(columns, values)) for values in zip(*columns.values())]
+        # NumPy scalars as Python numbers, so that 2.0 and 2 tell apart
+        result = [value.item() if hasattr(value, 'item') else value
+                  for value in Caplisp.eval_batch(tree, columns, use_numpy)]
+        expected = [tree.eval(row) for row in rows]
+        assert result == expected and list(map(type, result)) == list(map(type, expected)), source
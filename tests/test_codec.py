@@ -0,0 +1,68 @@
+import pickle
+
+import pytest
+
+from cps import codec
+from cps.cps import CapabilityExecutionState
+
+
+def double(m):
+    return m * 2
+
+
+def test_state_roundtrip():
+    state = CapabilityExecutionState({'handle': double, 'count': 3}, 'lambda msg: handle(msg)', 'orders.*')
+    loaded = CapabilityExecutionState.load(state.persist())
+    assert loaded == state
+    assert loaded.resume(21) == 42
+
+
+def test_no_pattern():
+    state = CapabilityExecutionState({}, 'lambda msg: msg', None)
+    assert CapabilityExecutionState.load(state.persist()) == state
+
+
+def test_compressed():
+    continuation = 'lambda msg: ' + ' + '.join(['handle(msg)'] * 50)
+    data = codec.encode_state({}, continuation, 'é')
+    assert len(data) < len(continuation)
+    assert codec.decode_state(data) == ({}, continuation, 'é')
+
+
+def test_delta():
+    data = codec.encode_delta({'x': 1}, ('gone',), 'lambda msg: msg', 'next', pickled={'items': pickle.dumps([1, 2])})
+    assert codec.decode_delta(data) == ({'x': 1, 'items': [1, 2]}, ('gone',), 'lambda msg: msg', 'next')
+    with pytest.raises(ValueError):
+        codec.decode_state(data)
+
+
+def test_load_memoryview():
+    data = CapabilityExecutionState({'x': 1}, 'lambda msg: msg', None).persist()
+    buffer = memoryview(b'junk' + data)[4:]
+    loaded = CapabilityExecutionState.load(buffer)
+    assert loaded.environment == {'x': 1}
+    assert loaded.message_pattern is None
+
+
+def test_bad_state():
+    with pytest.raises(ValueError):
+        CapabilityExecutionState.load(b'not a state at all')
+    data = bytearray(CapabilityExecutionState({}, 'lambda msg: msg', None).persist())
+    data[3] = 99
+    with pytest.raises(ValueError):
+        CapabilityExecutionState.load(bytes(data))
+    data[3] = 2
+    data[4] |= 0x80
+    with pytest.raises(ValueError):
+        CapabilityExecutionState.load(bytes(data))
+
+
+def test_version_1():
+    state = CapabilityExecutionState({'x': 1}, 'lambda msg: msg', None)
+    data = bytearray(state.persist())
+    data[3] = 1
+    assert CapabilityExecutionState.load(bytes(data)).environment == {'x': 1}
+    # version 1 had no deltas or references, so those flags can't be in it
+    data[4] |= codec.DELTA
+    with pytest.raises(ValueError):
+        CapabilityExecutionState.load(bytes(data))
@@ -1,8 +1,63 @@
-from cps.cps import CapabilityDefinition
+import pytest
+
+from cps.cps import CapabilityDefinition, CapabilityExecutionState, LInterpreter, continuation_cache
 
 
 def f_cps(resume):
     return 'executed'
 
 def test_cps_single():
-    CapabilityDefinition('f()').execute()
\ No newline at end of file
+    CapabilityDefinition('f()').execute()
+
+
+def test_resume():
+    state = CapabilityExecutionState({'handle': lambda m: m * 2}, 'lambda msg: handle(msg)', None)
+    assert state.resume(21) == 42
+
+
+def test_resume_errors():
+    def fail(m):
+        raise KeyError(m)
+    state = CapabilityExecutionState({'handle': fail}, 'lambda msg: handle(msg)', None)
+    assert state.resume(1) is None
+    with pytest.raises(KeyError):
+        state.resume(1, raise_errors=True)
+    with pytest.raises(NameError):
+        CapabilityExecutionState({}, 'lambda msg: handle(msg)', None).resume(1, raise_errors=True)
+
+
+def test_resume_cache():
+    continuation_cache.clear()
+    first = CapabilityExecutionState({'handle': lambda m: m + 1}, 'lambda msg: handle(msg)', None)
+    second = CapabilityExecutionState({'handle': lambda m: m - 1}, 'lambda msg: handle(msg)', None)
+    assert first.resume(1) == 2
+    assert second.resume(1) == 0
+    assert (continuation_cache.hits, continuation_cache.misses) == (1, 1)
+
+def test_linterpreter_frames():
+    interpreter = LInterpreter(symtable={'x': 'outer', 'add': lambda a, b: a + b})
+    assert interpreter.eval('(lambda x, y: add(x, y))(1, 2)') == 3
+    # the parameter's shadowed binding is back, and the other parameter is gone again
+    assert interpreter.symtable['x'] == 'outer'
+    assert 'y' not in interpreter.symtable
+    assert interpreter.eval('(lambda x: (lambda y: add(x, y))(10))(1)') == 11
+    assert interpreter.eval('(lambda x, y: add(x, y))(1, y=5)') == 6
+    for bad in ['(lambda x: x)(1, 2)', '(lambda x, y: x)(1)', '(lambda x: x)(1, x=2)']:
+        interpreter = LInterpreter(symtable={})
+        assert interpreter.eval(bad, raise_errors=False) is None
+        assert interpreter.error[0].exc is TypeError, bad
+
+
+def test_execute_environment():
+    environment = {'total_cps': lambda *values: lambda message: sum(values)}
+    assert CapabilityDefinition('total(1, 2 * 3)').execute(environment) == 7
+    # the caller's bindings are copied, not added to
+    assert list(environment) == ['total_cps']
+
+
+def test_persist_after_resume():
+    state = CapabilityExecutionState.load(CapabilityExecutionState({'k': 2}, 'lambda msg: msg * k', None).persist())
+    assert state.resume(5) == 10
+    # resuming leaves nothing of the interpreter's behind, so the state can still be saved
+    assert state.environment == {'k': 2}
+    assert CapabilityExecutionState.load(state.persist()).resume(6) == 12
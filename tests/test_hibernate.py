@@ -0,0 +1,110 @@
+import pickle
+
+import pytest
+
+from cps.cps import CapabilityExecutionState
+from cps.hibernate import HibernationManager, freeze, thaw
+from cps.simpy import Preempted, SimPy
+from cps.store import MemoryStore, SQLiteStore
+
+
+def host(reported):
+    return {"suspend": lambda cont: cont, "report": lambda x, cont: cont(reported.append(x))}
+
+
+def suspended(x, functions):
+    return SimPy.run(SimPy.parse("suspend()\nreport(x)"), dict(functions, x=x))
+
+
+def test_freeze_thaw():
+    reported = []
+    functions = host(reported)
+    cont = suspended(1, functions)
+    state = freeze(cont, functions)
+    # the host's functions stay behind, so the state persists
+    assert state.environment == {"x": 1, "__trampoline": True}
+    thawed = thaw(CapabilityExecutionState.load(state.persist()), functions)
+    thawed()
+    assert reported == [1]
+
+
+def wait(cont):
+    return cont
+
+
+def record(x, cont):
+    return cont(x)
+
+
+def test_pickle_lambda():
+    cont = SimPy.run(SimPy.parse("wait()\nrecord(x)"), {"wait": wait, "record": record, "x": [1, 2]})
+    copy = pickle.loads(pickle.dumps(cont))
+    assert copy.environment.flatten() == cont.environment.flatten() == {"record": record, "x": [1, 2]}
+    assert copy.trampoline and copy() is None
+
+
+def test_lru():
+    manager = HibernationManager(MemoryStore(), max_resident=2)
+    for name in "abc":
+        manager.park(name, CapabilityExecutionState({"name": name}, "lambda msg: msg", None))
+    assert list(manager.resident) == ["b", "c"] and manager.hibernating == {"a"}
+    assert manager.wake("b").environment == {"name": "b"}
+    assert manager.wake("a").environment == {"name": "a"}
+    assert "a" not in manager.store.rows
+    with pytest.raises(KeyError):
+        manager.wake("a")
+    metrics = manager.metrics()
+    assert (metrics["resident"], metrics["hibernating"], metrics["evictions"], metrics["rehydrations"]) == (1, 0, 1, 1)
+    assert metrics["rehydration_max"] >= 0
+
+
+def test_memory_budget(tmp_path):
+    reported = []
+    with SQLiteStore(str(tmp_path / "executions.db")) as store:
+        functions = host(reported)
+        conts = {str(i): suspended(i, functions) for i in range(10)}
+        manager = HibernationManager(store, memory_budget=1, functions=functions, sizer=lambda execution: 1)
+        for name, cont in conts.items():
+            manager.park(name, cont)
+        # every new arrival pushes the one before it out
+        assert list(manager.resident) == ["9"] and len(manager) == 10 and manager.evictions == 9
+        for name in conts:
+            manager.wake(name)()
+        assert reported == list(range(10))
+        assert len(manager) == 0 and len(store) == 0
+
+
+def test_hibernate_idle():
+    manager = HibernationManager(MemoryStore())
+    manager.park("a", CapabilityExecutionState({}, "lambda msg: msg", None))
+    assert manager.hibernate_idle(60) == 0
+    assert manager.hibernate_idle(0) == 1
+    assert "a" in manager and not manager.resident
+
+
+def test_unpersistable():
+    manager = HibernationManager(MemoryStore(), max_resident=1)
+    manager.park("a", CapabilityExecutionState({"f": lambda: None}, "lambda msg: msg", None))
+    manager.park("b", CapabilityExecutionState({}, "lambda msg: msg", None))
+    # "a" can't be pickled, so it stays in memory and "b" goes instead
+    assert "a" in manager.resident and manager.hibernating == {"b"}
+    assert manager.metrics()["pinned"] == 1
+    manager.park("c", CapabilityExecutionState({}, "lambda msg: msg", None))
+    assert manager.hibernating == {"b", "c"}
+    assert manager.wake("a").environment["f"]() is None
+    assert manager.metrics()["pinned"] == 0
+
+
+def test_freeze_preempted():
+    reported = []
+    functions = host(reported)
+    functions["step"] = lambda cont: cont(None)
+    code = "step()\nreport(1)\nstep()\nreport(2)\nstep()\nreport(3)"
+    cont = SimPy.run(SimPy.parse(code), dict(functions), fuel=3)
+    conts = 0
+    while isinstance(cont, Preempted):
+        # the pending call is a host function, or a continuation closing over them
+        state = CapabilityExecutionState.load(freeze(cont, functions).persist())
+        cont = SimPy.resume(thaw(state, functions), fuel=3)
+        conts += 1
+    assert conts > 1 and reported == [1, 2, 3]
@@ -0,0 +1,71 @@
+import ast
+
+from cps.optimize import optimize, metrics
+from cps.simpy import SimPy
+
+
+def optimized(source: str) -> str:
+    return ast.unparse(optimize(ast.parse(source)))
+
+
+def test_fold():
+    assert optimized("f(2 * 3 + 1, -(4), 'a' + 'b')") == "f(7, -4, 'ab')"
+    # errors are left for run time
+    assert optimized("f(1 / 0)") == "f(1 / 0)"
+    assert optimized("f(2 ** 100000)") == "f(2 ** 100000)"
+    # nor are results that grow too big one step at a time
+    assert optimized("f((2 ** 200) ** 256)") == f"f({2 ** 200} ** 256)"
+    assert optimized("f(((2 ** 200) ** 256) ** 256)") == f"f(({2 ** 200} ** 256) ** 256)"
+    assert optimized("f(2 ** 200 * 2 ** 200)") == f"f({2 ** 200} * {2 ** 200})"
+    assert optimized("f('ab' * 100 * 100)") == f"f({'ab' * 100!r} * 100)"
+    assert optimized("f(2 ** 8 << 8)") == "f(65536)"
+
+
+def test_beta():
+    assert optimized("(lambda x, k: f(x, k))(y, done)") == "f(y, done)"
+    assert optimized("(lambda x: x + 1)(2)") == "3"
+    # only the free occurrences are replaced
+    assert optimized("(lambda x: f(x, lambda x: g(x)))(1)") == "f(1, g)"
+    # y would be captured by the inner lambda
+    assert optimized("(lambda x: f(lambda y: h(x, y)))(y)") == "(lambda x: f(lambda y: h(x, y)))(y)"
+    # calls must happen, so they are not substituted
+    assert optimized("(lambda x: f(x, x))(g())") == "(lambda x: f(x, x))(g())"
+
+
+def test_eta():
+    assert optimized("f(lambda _: k(_))") == "f(k)"
+    assert optimized("f_cps(lambda: g_cps())") == "f_cps(g_cps)"
+    assert optimized("f(lambda x: x(x))") == "f(lambda x: x(x))"
+
+
+def test_complete():
+    assert ast.unparse(optimize(SimPy.parse("f()\ng()"))) == "f(lambda _: g(complete))"
+    assert ast.unparse(optimize(SimPy.parse("f()"), complete=None)) == "f(lambda _: complete())"
+
+
+def test_same_results():
+    def step(label):
+        def builtin(cont):
+            called.append(label)
+            return cont(None)
+        return builtin
+
+    env = {"f": step("f"), "g": step("g"), "h": step("h"), "plus": lambda x, y: x + y}
+    programs = [lambda: SimPy.parse("f()\ng()\nh()"),
+                lambda: ast.parse("(lambda x: lambda y: plus(x, y))(2)(3)"),
+                lambda: ast.parse("(lambda k: k(1))(lambda x: plus(x, 1))")]
+    for program in programs:
+        called = []
+        plain = SimPy.run(program(), env)
+        plain_called = called
+        called = []
+        assert SimPy.run(optimize(program()), env) == plain
+        assert called == plain_called
+
+
+def test_metrics():
+    tree = SimPy.parse("\n".join(f"step{i}()" for i in range(20)))
+    before = metrics(tree)
+    after = metrics(optimize(tree))
+    assert after["nodes"] < before["nodes"]
+    assert after["size"] < before["size"]
@@ -0,0 +1,54 @@
+import pytest
+
+from cps.cps import CapabilityExecutionState
+from cps.routing import MessageRouter
+
+
+def waiting(pattern):
+    return CapabilityExecutionState({}, 'lambda msg: msg', pattern)
+
+
+def router(**patterns):
+    r = MessageRouter()
+    for execution_id, pattern in patterns.items():
+        r.add(execution_id, waiting(pattern))
+    return r
+
+
+def test_exact():
+    r = router(a='orders.42.paid', b='orders.43.paid')
+    assert set(r.dispatch('orders.42.paid')) == {'a'}
+    assert r.dispatch('orders.44.paid') == {}
+
+
+def test_wildcards():
+    r = router(exact='orders.42.paid', star='orders.*.paid', tail='orders.#', everything='#',
+               middle='orders.#.paid', other='invoices.*')
+    assert set(r.dispatch('orders.42.paid')) == {'exact', 'star', 'tail', 'everything', 'middle'}
+    assert set(r.dispatch('orders')) == {'tail', 'everything'}
+    assert set(r.dispatch('orders.42.shipped')) == {'tail', 'everything'}
+    assert set(r.dispatch('orders.paid')) == {'tail', 'everything', 'middle'}
+    assert set(r.dispatch('invoices.7')) == {'everything', 'other'}
+    assert set(r.dispatch('invoices.7.8')) == {'everything'}
+
+
+def test_remove():
+    r = router(a='orders.*.paid', b='orders.*.paid', c='orders.1')
+    assert r.remove('a').message_pattern == 'orders.*.paid'
+    r.remove('c')
+    assert set(r.dispatch('orders.1.paid')) == {'b'}
+    r.remove('b')
+    assert len(r) == 0
+    assert not r.root.children and not r.exact
+
+
+def test_readd():
+    r = router(a='orders.*')
+    r.add('a', waiting('invoices.*'))
+    assert r.dispatch('orders.1') == {}
+    assert set(r.dispatch('invoices.1')) == {'a'}
+
+
+def test_not_waiting():
+    with pytest.raises(ValueError):
+        MessageRouter().add('a', waiting(None))
@@ -0,0 +1,131 @@
+import asyncio
+import time
+
+import pytest
+
+from cps.runtime import AsyncRuntime
+from cps.simpy import SimPy, Lambda
+
+
+def test_interleaving():
+    myast = SimPy.parse("wait()\nrecord()")
+    finished = []
+    running = 0
+    most_running = 0
+
+    async def wait(cont):
+        nonlocal running, most_running
+        running += 1
+        most_running = max(most_running, running)
+        await asyncio.sleep(0.05)
+        running -= 1
+        return cont(None)
+
+    async def main():
+        async with AsyncRuntime(max_concurrent=200) as runtime:
+            futures = [await runtime.submit(myast, {"wait": wait, "record": lambda cont: cont(finished.append(None))})
+                       for i in range(1000)]
+            await asyncio.gather(*futures)
+
+    start = time.perf_counter()
+    asyncio.run(main())
+    # 1000 waits of 50ms, 200 at a time, is about 0.25s; one at a time it would be 50s
+    assert time.perf_counter() - start < 5
+    assert len(finished) == 1000
+    assert most_running == 200
+
+
+def test_suspend_and_resume():
+    myast = SimPy.parse("suspend()\nfetch()\nrecord()")
+    called = []
+
+    async def fetch(cont):
+        await asyncio.sleep(0)
+        return cont(None)
+
+    env = {"suspend": lambda cont: cont, "fetch": fetch, "record": lambda cont: cont(called.append("record"))}
+
+    async def main():
+        async with AsyncRuntime(max_concurrent=2) as runtime:
+            cont = await runtime.run(myast, env)
+            assert isinstance(cont, Lambda)
+            assert called == []
+            await (await runtime.resume(cont, None))
+            assert called == ["record"]
+
+    asyncio.run(main())
+
+
+def test_backpressure():
+    release = None
+    started = 0
+
+    async def block(cont):
+        nonlocal started
+        started += 1
+        await release.wait()
+        return cont(None)
+
+    myast = SimPy.parse("block()")
+
+    async def main():
+        nonlocal release
+        release = asyncio.Event()
+        async with AsyncRuntime(max_concurrent=2, max_pending=3) as runtime:
+            futures = [await runtime.submit(myast, {"block": block}) for _ in range(3)]
+            fourth = asyncio.create_task(runtime.submit(myast, {"block": block}))
+            await asyncio.sleep(0.05)
+            # two running, one queued, and the fourth submit is held back
+            assert started == 2
+            assert not fourth.done()
+            release.set()
+            futures.append(await fourth)
+            await asyncio.gather(*futures)
+        assert started == 4
+
+    asyncio.run(main())
+
+
+def test_failure():
+    async def fail(cont):
+        raise RuntimeError("boom")
+
+    async def main():
+        async with AsyncRuntime(max_concurrent=1) as runtime:
+            with pytest.raises(RuntimeError):
+                await runtime.run(SimPy.parse("fail()"), {"fail": fail})
+            # the worker survives
+            assert await runtime.run(SimPy.parse("ok()"), {"ok": lambda cont: "ok"}) == "ok"
+
+            # even a builtin's I/O being cancelled only cancels that execution
+            async def cancelled(cont):
+                request = asyncio.create_task(asyncio.sleep(10))
+                request.cancel()
+                return cont(await request)
+            with pytest.raises(asyncio.CancelledError):
+                await runtime.run(SimPy.parse("cancelled()"), {"cancelled": cancelled})
+            assert await runtime.run(SimPy.parse("ok()"), {"ok": lambda cont: "ok"}) == "ok"
+
+    asyncio.run(main())
+
+
+def test_fuel_fairness():
+    finished = []
+
+    def step(cont):
+        return cont(None)
+
+    def done(name):
+        return lambda cont: finished.append(name)
+
+    long = SimPy.parse("\n".join(["step()"] * 10_000 + ["done()"]))
+
+    async def main():
+        async with AsyncRuntime(max_concurrent=1, fuel=100) as runtime:
+            slow = await runtime.submit(long, {"step": step, "done": done("long")})
+            fast = await runtime.submit(SimPy.parse("step()\ndone()"), {"step": step, "done": done("short")})
+            await asyncio.gather(slow, fast)
+
+    asyncio.run(main())
+    # with one worker and no fuel limit, the long one would have finished first
+    assert finished == ["short", "long"]
@@ -1,7 +1,7 @@
 import ast
 import operator
 
-from cps.simpy import SimPy, Lambda
+from cps.simpy import SimPy, Lambda, CpsTransformer, Preempted, Scope, free_variables
 
 
 def test_simple():
@@ -61,3 +61,158 @@ def test_closure():
 # def test_compose():
 #     myast = SimPy.parse('f(g())')
 #     assert myast == ast.parse('g(lambda x: f(x))')
+
+
+def chain(length: int) -> ast.Module:
+    # build step(lambda _: step(lambda _: ... complete())) without going through the parser,
+    # which cannot nest this deeply
+    body = ast.Call(func=ast.Name(id="complete", ctx=ast.Load()), args=[], keywords=[])
+    for _ in range(length):
+        cont = ast.Lambda(args=CpsTransformer().blank_arguments(), body=body)
+        body = ast.Call(func=ast.Name(id="step", ctx=ast.Load()), args=[cont], keywords=[])
+    return ast.Module(body=[ast.Expr(value=body)], type_ignores=[])
+
+
+def test_trampoline():
+    myast = SimPy.parse("f()\ng()")
+
+    called = []
+
+    def f(cont):
+        called.append("f")
+        return cont(None)
+
+    def g(cont):
+        called.append("g")
+        return cont(None)
+
+    SimPy.run(myast, {"f": f, "g": g})
+    assert called == ["f", "g"]
+
+
+def test_trampoline_suspend():
+    myast = SimPy.parse("suspend()\ndo_something()")
+
+    called = []
+
+    def suspend(cont):
+        called.append("suspend")
+        return cont
+
+    def do_something(cont):
+        called.append("do_something")
+        return cont(None)
+
+    cont = SimPy.run(myast, {"suspend": suspend, "do_something": do_something})
+    assert isinstance(cont, Lambda)
+    assert called == ["suspend"]
+
+    # resuming from outside a driver starts one up
+    cont(None)
+    assert called == ["suspend", "do_something"]
+
+
+def test_trampoline_closure():
+    myast = ast.parse("(lambda x: lambda y: plus(x,y))(2)(3)")
+    assert SimPy.run(myast, {"plus": operator.add}) == 5
+
+
+def test_trampoline_deep():
+    steps = []
+
+    def step(cont):
+        steps.append(len(steps))
+        return cont(None)
+
+    SimPy.run(chain(10_000), {"step": step})
+    assert len(steps) == 10_000
+
+
+def test_scope():
+    outer = SimPy.scope({"x": 1, "y": 2})
+    inner = Scope({"x": 10}, outer)
+    assert inner["x"] == 10
+    assert inner["y"] == 2
+    assert "complete" in inner
+    assert "z" not in inner
+
+
+def test_shadowing():
+    # parameters shadow the names the lambda closed over
+    myast = ast.parse("(lambda x: (lambda x: x)(3))(2)")
+    assert SimPy.eval(myast, {}) == 3
+
+
+def test_parse_long():
+    myast = SimPy.parse("\n".join(f"step({i})" for i in range(10_000)))
+
+    seen = []
+
+    def step(i, cont):
+        seen.append(i)
+        return cont(None)
+
+    SimPy.run(myast, {"step": step})
+    assert seen == list(range(10_000))
+
+
+def test_free_variables():
+    node = ast.parse("lambda x: f(x, lambda y: g(x, y, z))").body[0].value
+    assert free_variables(node) == {"f", "g", "z"}
+    assert free_variables(node.body.args[1]) == {"g", "x", "z"}
+
+
+def test_closure_pruning():
+    myast = SimPy.parse("suspend()\nuse(x)")
+    env = {"suspend": lambda cont: cont, "use": lambda x, cont: cont(x), "x": 1, "unused": bytearray(1000)}
+    cont = SimPy.eval(myast, env)
+    assert cont.environment.bindings == {"use": env["use"], "x": 1}
+    assert cont.environment.parent.bindings is SimPy.BUILTINS
+
+
+def test_fork():
+    myast = SimPy.parse("suspend()\nreport(x)")
+    reported = []
+    env = {"suspend": lambda cont: cont, "report": lambda x, cont: cont(reported.append(x)), "x": 1}
+    cont = SimPy.eval(myast, env)
+
+    branches = [cont.fork() for _ in range(3)]
+    branches[1].environment["x"] = 2
+    grandchild = branches[1].fork()
+    grandchild.environment["x"] = 3
+
+    for branch in branches + [grandchild, cont]:
+        branch(None)
+    assert reported == [1, 2, 1, 3, 1]
+    # nothing was copied into the branches that didn't write
+    assert branches[0].environment.bindings == {}
+    assert branches[0].environment.parent is cont.environment
+
+
+def test_fuel():
+    # loops forever
+    forever = ast.parse("(lambda f: f(f))(lambda f: f(f))")
+    cont = SimPy.run(forever, {}, fuel=100)
+    assert isinstance(cont, Preempted)
+    assert isinstance(SimPy.resume(cont, fuel=100), Preempted)
+
+    steps = []
+
+    def step(cont):
+        steps.append(None)
+        return cont(None)
+
+    cont = SimPy.run(chain(1000), {"step": step}, fuel=300)
+    while isinstance(cont, Preempted):
+        before = len(steps)
+        cont = SimPy.resume(cont, fuel=300)
+        assert len(steps) - before <= 300
+    assert len(steps) == 1000
+
+
+def test_preempted_is_a_continuation():
+    seen = []
+    cont = SimPy.run(ast.parse("f(1, 2)"), {"f": lambda a, b: seen.append((a, b))}, fuel=0)
+    assert isinstance(cont, Lambda)
+    cont(None)
+    assert seen == [(1, 2)]
@@ -0,0 +1,180 @@
+import pytest
+
+from cps.cps import CapabilityExecutionState
+from cps.store import MemoryStore, SQLiteStore, TrackedEnvironment
+
+
+def waiting(pattern, **environment):
+    return CapabilityExecutionState(environment, 'lambda msg: msg', pattern)
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        yield MemoryStore()
+    else:
+        with SQLiteStore(str(tmp_path / 'executions.db'), batch_size=3, max_delay=60) as store:
+            yield store
+
+
+def test_save_load(store):
+    store.save('a', waiting('orders.paid', x=1))
+    store.save('b', waiting('orders.paid', x=2))
+    store.save('c', waiting('orders.shipped'))
+    store.save('a', waiting('orders.paid', x=3))
+    assert store.load('a') == waiting('orders.paid', x=3)
+    assert store.load('missing') is None
+    assert store.waiting_on('orders.paid') == {'a': waiting('orders.paid', x=3), 'b': waiting('orders.paid', x=2)}
+    store.delete('b')
+    store.delete('missing')
+    assert store.load('b') is None
+    assert set(store.waiting_on('orders.paid')) == {'a'}
+    assert len(store) == 2
+
+
+
+def test_save_after_resume(store):
+    store.save('a', waiting('orders.paid', x=1))
+    state = store.load('a')
+    assert state.resume(5) == 5
+    store.save('a', state)
+    store.flush()
+    assert store.load('a') == waiting('orders.paid', x=1)
+
+
+def test_group_commit(tmp_path):
+    path = str(tmp_path / 'executions.db')
+    store = SQLiteStore(path, batch_size=3, max_delay=60)
+    store.save_many((str(i), waiting('orders.paid', i=i)) for i in range(4))
+    # the first three went out together; the fourth is still buffered
+    assert list(store.pending) == ['3']
+    with SQLiteStore(path) as other:
+        assert len(other) == 3
+    store.close()
+
+    with SQLiteStore(path) as reopened:
+        assert reopened.connection.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+        assert reopened.load('3') == waiting('orders.paid', i=3)
+        assert len(reopened.waiting_on('orders.paid')) == 4
+
+
+def checkpoint(environment):
+    changes = environment.changes()
+    environment.checkpoint(changes)
+    return changes.changed, changes.deleted
+
+
+def test_tracked_environment():
+    environment = TrackedEnvironment(a=1, b=2, c=3, items=[1])
+    # nothing has been checkpointed yet, so everything counts as changed
+    assert checkpoint(environment) == ({'a': 1, 'b': 2, 'c': 3, 'items': [1]}, ())
+    environment['a'] = 10
+    environment.update(d=4)
+    del environment['b']
+    environment.pop('c')
+    environment.setdefault('c', 30)
+    assert checkpoint(environment) == ({'a': 10, 'c': 30, 'd': 4}, ('b',))
+    assert checkpoint(environment) == ({}, ())
+    # changes made in place are found by comparing digests
+    environment['items'].append(2)
+    assert checkpoint(environment) == ({'items': [1, 2]}, ())
+    environment.clear()
+    assert set(checkpoint(environment)[1]) == {'a', 'c', 'd', 'items'}
+
+
+def test_mutated_in_place(tmp_path):
+    path = str(tmp_path / 'executions.db')
+    with SQLiteStore(path, batch_size=1) as store:
+        environment = TrackedEnvironment(items=[1], big='x' * 10_000)
+        store.save('a', CapabilityExecutionState(environment, 'lambda msg: msg', None))
+        environment['items'].append(2)
+        store.save('a', CapabilityExecutionState(environment, 'lambda msg: msg', None))
+        # still a delta, and a small one
+        assert store.connection.execute("SELECT COUNT(*), SUM(length(state)) FROM deltas").fetchone()[1] < 200
+    with SQLiteStore(path) as store:
+        assert store.load('a').environment == {'items': [1, 2], 'big': 'x' * 10_000}
+
+
+def test_failed_save_keeps_changes(tmp_path):
+    with SQLiteStore(str(tmp_path / 'executions.db'), batch_size=1) as store:
+        environment = TrackedEnvironment(x=1)
+        store.save('a', CapabilityExecutionState(environment, 'lambda msg: msg', None))
+        environment['x'] = 2
+        environment['bad'] = lambda: None
+        with pytest.raises(Exception):
+            store.save('a', CapabilityExecutionState(environment, 'lambda msg: msg', None))
+        del environment['bad']
+        store.save('a', CapabilityExecutionState(environment, 'lambda msg: msg', None))
+        assert store.load('a').environment == {'x': 2}
+
+
+
+def test_shared_environment(tmp_path):
+    path = str(tmp_path / 'executions.db')
+    with SQLiteStore(path, batch_size=1) as store:
+        environment = TrackedEnvironment(x=1, items=[])
+        store.save('a', CapabilityExecutionState(environment, 'lambda msg: msg', None))
+        environment['x'] = 2
+        environment['items'].append(1)
+        # b's checkpoint takes these changes, but a hasn't saved them yet
+        store.save('b', CapabilityExecutionState(environment, 'lambda msg: msg', None))
+        environment['y'] = 3
+        store.save('a', CapabilityExecutionState(environment, 'lambda msg: msg', None))
+    with SQLiteStore(path) as store:
+        assert store.load('a').environment == {'x': 2, 'items': [1], 'y': 3}
+        assert store.load('b').environment == {'x': 2, 'items': [1]}
+
+
+def test_deltas(tmp_path):
+    path = str(tmp_path / 'executions.db')
+    with SQLiteStore(path, batch_size=1, compact_every=3) as store:
+        environment = TrackedEnvironment(big='x' * 10_000, step=0)
+        for step in range(1, 7):
+            environment['step'] = step
+            if step == 2:
+                del environment['big']
+            if step == 4:
+                environment['big'] = 'y' * 10_000
+            store.save('a', CapabilityExecutionState(environment, f'lambda msg: {step}', f'step.{step}'))
+        # a snapshot, three deltas, a new snapshot and a delta after it
+        deltas = store.connection.execute("SELECT seq, length(state) FROM deltas WHERE id = 'a'").fetchall()
+        assert [seq for seq, _ in deltas] == [1]
+        assert deltas[0][1] < 200
+        assert store.waiting_on('step.6') == {'a': CapabilityExecutionState({'big': 'y' * 10_000, 'step': 6},
+                                                                            'lambda msg: 6', 'step.6')}
+        assert store.waiting_on('step.5') == {}
+
+        # another environment under the same id starts from a snapshot again
+        store.save('a', CapabilityExecutionState(TrackedEnvironment(step=0), 'lambda msg: 0', 'step.0'))
+        assert store.connection.execute("SELECT COUNT(*) FROM deltas").fetchone()[0] == 0
+
+    with SQLiteStore(path, batch_size=1, compact_every=3) as store:
+        state = store.load('a')
+        state.environment['step'] = 1
+        store.save('a', state._replace(continuation='lambda msg: 1'))
+        assert store.connection.execute("SELECT COUNT(*) FROM deltas").fetchone()[0] == 1
+        assert store.load('a').environment == {'step': 1}
+        store.delete('a')
+        assert store.load('a') is None
+        assert store.connection.execute("SELECT COUNT(*) FROM deltas").fetchone()[0] == 0
+
+
+def test_dedup(tmp_path):
+    path = str(tmp_path / 'executions.db')
+    continuation = 'lambda msg: ' + ' + '.join(f'step{i}(msg)' for i in range(50))
+    with SQLiteStore(path, batch_size=10) as store:
+        for i in range(25):
+            store.save(str(i), CapabilityExecutionState({'i': i}, continuation, 'orders.paid'))
+        store.save('other', waiting('orders.paid'))
+        assert store.load('3') == CapabilityExecutionState({'i': 3}, continuation, 'orders.paid')
+        store.flush()
+        assert store.connection.execute("SELECT COUNT(*) FROM continuations").fetchone()[0] == 2
+
+    with SQLiteStore(path) as store:
+        states = store.waiting_on('orders.paid')
+        assert len(states) == 26
+        # one copy of the source, shared by every state loaded with it
+        assert len({id(state.continuation) for state in states.values()}) == 2
+        assert states['other'] == waiting('orders.paid')
+    with SQLiteStore(path, dedup=False) as store:
+        assert store.load('7').continuation == continuation